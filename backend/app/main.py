@@ -5,6 +5,16 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from app.routes import auth, products, cart, orders, upload, admin, reports, virtual_makeup, consultation, beauty_tips, reviews
 from app.utils.database import connect_to_mongo, close_mongo_connection
+from app.utils.image_ingest import UploadSizeLimit
+from app.utils.catalog_cache import catalog_cache
+from app.utils.makeup_jobs import makeup_jobs
+from app.utils.makeup_pool import makeup_pool
+from app.utils.result_cache import result_cache
+from app.utils.selfie_sessions import selfie_sessions
+from app.utils.shade_registry import shade_registry
+from app.utils.shade_index import shade_index
+from app.utils.try_on_quota import try_on_quota
+from app.utils.warmup import start_warm_up
 
 app = FastAPI(
     title="Flashion API",
@@ -12,6 +22,10 @@ app = FastAPI(
     openapi_url="/api/openapi.json"
 )
 
+# Turn oversized try-on uploads away before their multipart body is received
+# (added before CORS, so the 413 still carries the CORS headers)
+app.add_middleware(UploadSizeLimit, path_prefix="/api/virtual-makeup")
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -30,11 +44,33 @@ app.mount("/static", StaticFiles(directory="app/static"), name="static")
 @app.on_event("startup")
 async def startup_db_client():
     await connect_to_mongo()
+    await catalog_cache.load()
+    await shade_registry.refresh()
+    await shade_index.refresh()
+    try_on_quota.start()
+    await makeup_jobs.start()
+
+@app.on_event("startup")
+async def startup_makeup_pool():
+    makeup_pool.start()
+    await result_cache.start()
+    selfie_sessions.start()
+    # cv2/numpy are imported lazily by the try-on routes; load them in the background
+    start_warm_up()
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    # Interrupted jobs are marked failed, then buffered try-on counts are
+    # written out before the connection goes away
+    await makeup_jobs.stop()
+    await try_on_quota.stop()
     await close_mongo_connection()
 
+@app.on_event("shutdown")
+async def shutdown_makeup_pool():
+    result_cache.stop()
+    makeup_pool.shutdown()
+
 # Include routers
 app.include_router(auth.router, prefix="/api/auth", tags=["auth"])
 app.include_router(products.router, prefix="/api/products", tags=["products"])
@@ -0,0 +1,198 @@
+"""Render every catalog lipstick and blush shade on a set of reference model photos.
+
+Each product offered for try-on (listed in the storefront, and in a category
+of TRY_ON_CATEGORIES such as "Son môi" for lips or "Má hồng" for cheeks)
+contributes every string in its ``colors``; each of those shades is
+rendered on every model photo. Faces are detected once per model photo, and
+the renders are spread over a process pool of warm makeup workers.
+
+Outputs are written to --output-dir (by default the static uploads tree,
+served under /static/uploads/swatches) with content-hashed names: the hash
+covers the model photo's bytes, the shade, the intensity, the preset and
+the encoding. A run therefore only renders swatches that do not exist yet,
+so it can be interrupted and resumed, and re-running after new shades are
+added renders only those. manifest.json maps product id -> color -> model
+photo -> URL.
+
+Usage (from the backend directory):
+
+    python -m app.render_swatches --models photos/model1.jpg photos/model2.jpg
+    python -m app.render_swatches --models photos/*.jpg --workers 8 --dry-run
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import as_completed
+from app.utils import makeup_tasks
+from app.utils.database import connect_to_mongo, close_mongo_connection, get_database
+from app.utils.files import atomic_write
+from app.utils.image_encode import OUTPUT_FORMATS, available_formats
+from app.utils.makeup_pool import create_executor
+from app.utils.render_presets import RENDER_PRESETS
+from app.utils.result_cache import result_key
+from app.utils.shade_registry import parse_color, try_on_makeup_type, TRY_ON_PRODUCT_FILTER
+
+# Intensity of each makeup type on the swatches
+SWATCH_INTENSITY = {
+    "lips": int(os.getenv("SWATCH_LIPS_INTENSITY", 70)),
+    "cheeks": int(os.getenv("SWATCH_CHEEKS_INTENSITY", 50)),
+}
+SWATCH_DIR = os.getenv("SWATCH_DIR", "app/static/uploads/swatches")
+SWATCH_BASE_URL = os.getenv("SWATCH_BASE_URL", "/static/uploads/swatches")
+# Swatches rendered per worker task; smaller chunks balance better, larger ones decode less often
+SWATCH_CHUNK_SIZE = 32
+
+
+async def load_shades() -> dict:
+    """{product id: {"name", "category", "makeup_type", "colors"}} of every try-on product"""
+    await connect_to_mongo()
+    try:
+        db = get_database()
+        products = {}
+        async for product in db.products.find(
+            TRY_ON_PRODUCT_FILTER,
+            {"name": 1, "category": 1, "colors": 1}
+        ):
+            makeup_type = try_on_makeup_type(product)
+            colors = [color for color in product.get("colors") or [] if isinstance(color, str) and color.strip()]
+            if makeup_type and colors:
+                products[str(product["_id"])] = {
+                    "name": product.get("name"),
+                    "category": product["category"],
+                    "makeup_type": makeup_type,
+                    "colors": colors,
+                }
+        return products
+    finally:
+        await close_mongo_connection()
+
+
+def plan(products: dict, models: list, output_dir: str, output_format: str, quality: int, preset: str):
+    """Work still to do and the complete manifest.
+
+    Returns ({model path: [(file name, makeup type, BGR, intensity)]}, manifest),
+    where only swatches missing from ``output_dir`` are listed as work.
+    """
+    model_bytes = {}
+    for path in models:
+        with open(path, "rb") as f:
+            model_bytes[path] = f.read()
+
+    extension = "jpg" if output_format == "jpeg" else output_format
+    quality = quality or RENDER_PRESETS[preset]["quality"]
+    todo = {path: [] for path in models}
+    planned = set()
+    manifest = {}
+    for product_id, product in products.items():
+        makeup_type = product["makeup_type"]
+        intensity = SWATCH_INTENSITY[makeup_type]
+        colors = {}
+        for color in product["colors"]:
+            bgr = parse_color(color)
+            colors[color] = {}
+            for path in models:
+                key = result_key(model_bytes[path], {
+                    makeup_type: [list(bgr), intensity],
+                    "quality": quality,
+                    "preset": preset,
+                }, output_format)
+                name = f"{key}.{extension}"
+                colors[color][os.path.basename(path)] = name
+                # Products sharing a shade share the file
+                if name not in planned and not os.path.exists(os.path.join(output_dir, name)):
+                    planned.add(name)
+                    todo[path].append((name, makeup_type, bgr, intensity))
+        manifest[product_id] = {"name": product["name"], "category": product["category"], "colors": colors}
+    return {path: shades for path, shades in todo.items() if shades}, manifest
+
+
+def write_manifest(output_dir: str, manifest: dict):
+    """Write manifest.json with the URL of every swatch that exists (photos without a face have none)"""
+    for product in manifest.values():
+        for color, swatches in product["colors"].items():
+            product["colors"][color] = {
+                model: f"{SWATCH_BASE_URL}/{name}"
+                for model, name in swatches.items()
+                if os.path.exists(os.path.join(output_dir, name))
+            }
+    atomic_write(
+        os.path.join(output_dir, "manifest.json"),
+        json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8")
+    )
+
+
+def render(todo: dict, output_dir: str, output_format: str, quality: int, preset: str, workers: int) -> int:
+    """Render the planned swatches in a process pool; returns how many were written"""
+    executor = create_executor(workers)
+    total = sum(len(shades) for shades in todo.values())
+    written = 0
+    started = time.perf_counter()
+    with executor:
+        detections = {path: executor.submit(makeup_tasks.detect_model, path, preset) for path in todo}
+        renders = []
+        for path, detection in detections.items():
+            try:
+                landmarks = detection.result()
+            except (OSError, ValueError) as e:
+                print(f"Could not read {path} ({e}), skipping its {len(todo[path])} swatches", file=sys.stderr)
+                total -= len(todo[path])
+                continue
+            if landmarks is None:
+                print(f"No face found in {path}, skipping its {len(todo[path])} swatches", file=sys.stderr)
+                total -= len(todo[path])
+                continue
+            shades = todo[path]
+            chunks = max(1, min(math.ceil(len(shades) / SWATCH_CHUNK_SIZE), workers))
+            size = math.ceil(len(shades) / chunks)
+            for start in range(0, len(shades), size):
+                renders.append(executor.submit(
+                    makeup_tasks.render_swatches, path, landmarks, shades[start:start + size],
+                    output_dir, output_format, quality, preset
+                ))
+        for future in as_completed(renders):
+            written += len(future.result())
+            elapsed = time.perf_counter() - started
+            print(f"{written}/{total} swatches ({written / elapsed:.1f}/s)")
+    return written
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", nargs="+", required=True, help="reference model photos")
+    parser.add_argument("--output-dir", default=SWATCH_DIR)
+    parser.add_argument("--format", default="jpeg", choices=list(OUTPUT_FORMATS))
+    parser.add_argument("--quality", type=int, help="encoder quality (default: the preset's)")
+    parser.add_argument("--preset", default="hq", choices=list(RENDER_PRESETS))
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be rendered")
+    args = parser.parse_args(argv)
+
+    if args.format not in available_formats():
+        parser.error(f"this Pillow build cannot encode {args.format}")
+    models = sorted(set(args.models))
+    missing = [path for path in models if not os.path.isfile(path)]
+    if missing:
+        parser.error(f"model photos not found: {', '.join(missing)}")
+
+    products = asyncio.run(load_shades())
+    os.makedirs(args.output_dir, exist_ok=True)
+    todo, manifest = plan(products, models, args.output_dir, args.format, args.quality, args.preset)
+    pending = sum(len(shades) for shades in todo.values())
+    shades = sum(len(product["colors"]) for product in products.values())
+    print(f"{len(products)} products, {shades} shades, {len(models)} model photos: {pending} swatches to render")
+
+    if args.dry_run:
+        return 0
+    if pending:
+        render(todo, args.output_dir, args.format, args.quality, args.preset, args.workers)
+    write_manifest(args.output_dir, manifest)
+    print(f"Wrote {os.path.join(args.output_dir, 'manifest.json')}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,6 +6,9 @@ from pydantic import BaseModel, Field
 from app.schemas.product import Product, ProductCreate
 from app.schemas.user import User, UserInDB
 from app.utils.database import get_database
+from app.utils.shade_registry import shade_registry
+from app.utils.shade_index import shade_index
+from app.utils.catalog_cache import catalog_cache
 from app.utils.auth import get_current_admin_user, get_password_hash
 from app.routes.auth import password_reset_tokens, send_password_reset_email, send_password_reset_sms, password_reset_requests
 from ..models.user import User as MongoUser
@@ -84,6 +87,9 @@ async def create_product(
     
     result = await db.products.insert_one(product_dict)
     created_product = await db.products.find_one({"_id": result.inserted_id})
+    catalog_cache.put(created_product)
+    await shade_registry.refresh()
+    await shade_index.refresh()
     
     return Product(**created_product)
 
@@ -115,6 +121,9 @@ async def update_product(
         )
     
     updated_product = await db.products.find_one({"_id": ObjectId(product_id)})
+    catalog_cache.put(updated_product)
+    await shade_registry.refresh()
+    await shade_index.refresh()
     return Product(**updated_product)
 
 @router.delete("/products/{product_id}/", status_code=status.HTTP_204_NO_CONTENT)
@@ -135,6 +144,9 @@ async def delete_product(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Product not found"
         )
+    catalog_cache.product_removed(product_id)
+    await shade_registry.refresh()
+    await shade_index.refresh()
 
 @router.get("/users/", response_model=List[User])
 async def get_admin_users(
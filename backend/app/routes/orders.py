@@ -6,6 +6,7 @@ from app.schemas.order import Order, OrderCreate, OrderStatus, PaymentStatus, Pa
 from app.schemas.user import User
 from app.utils.database import get_database
 from app.utils.auth import get_current_active_user
+from app.utils.catalog_cache import catalog_cache
 
 from pydantic import BaseModel
 
@@ -65,6 +66,7 @@ async def create_order(
             {"_id": ObjectId(item.product_id)},
             {"$inc": {"stock": -item.quantity}}
         )
+        await catalog_cache.product_changed(item.product_id)
     
     # Clear user's cart
     await db.carts.delete_one({"user_id": ObjectId(str(current_user.id))})
@@ -4,6 +4,9 @@ from datetime import datetime
 from bson import ObjectId
 from app.schemas.product import Product, ProductCreate, ProductList
 from app.utils.database import get_database
+from app.utils.shade_registry import shade_registry
+from app.utils.shade_index import shade_index
+from app.utils.catalog_cache import catalog_cache
 from app.utils.auth import get_current_active_user, get_current_admin_user
 from app.schemas.user import User
 
@@ -22,30 +25,18 @@ async def get_products(
     page: int = 1,
     limit: int = 12
 ):
-    db = get_database()
     skip = (page - 1) * limit
     
-    # Build query
-    query = {"is_active": True}
-    if category and category != "all":
-        query["category"] = category
-    
-    # Build sort options
-    sort_options = {
-        "newest": [("created_at", -1)],
-        "price-asc": [("price", 1)],
-        "price-desc": [("price", -1)],
-        "name-asc": [("name", 1)]
-    }
-    sort_order = sort_options.get(sort, sort_options["newest"])
-    
-    # Get total count for pagination
-    total_count = await db.products.count_documents(query)
+    # Served from the in-process catalog, already filtered to active
+    # products and ordered per (category, sort)
+    total_count, products = await catalog_cache.page(
+        category if category and category != "all" else None,
+        sort,
+        skip,
+        limit
+    )
     total_pages = (total_count + limit - 1) // limit
     
-    # Get products with pagination and sorting
-    products = await db.products.find(query).sort(sort_order).skip(skip).limit(limit).to_list(length=limit)
-    
     return {
         "products": [
             {
@@ -111,14 +102,13 @@ async def search_products(q: str, limit: int = 10):
 
 @router.get("/{product_id}", response_model=Product)
 async def get_product(product_id: str):
-    db = get_database()
     if not ObjectId.is_valid(product_id):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid product ID"
         )
     
-    product = await db.products.find_one({"_id": ObjectId(product_id)})
+    product = await catalog_cache.get(product_id)
     if not product:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -155,6 +145,9 @@ async def create_product(
     
     result = await db.products.insert_one(product_dict)
     created_product = await db.products.find_one({"_id": result.inserted_id})
+    catalog_cache.put(created_product)
+    await shade_registry.refresh()
+    await shade_index.refresh()
     
     return {
         "_id": str(created_product["_id"]),
@@ -201,6 +194,9 @@ async def update_product(
         )
     
     updated_product = await db.products.find_one({"_id": ObjectId(product_id)})
+    catalog_cache.put(updated_product)
+    await shade_registry.refresh()
+    await shade_index.refresh()
     return Product(**updated_product)
 
 @router.delete("/{product_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -220,4 +216,7 @@ async def delete_product(
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Product not found"
-        ) 
\ No newline at end of file
+        )
+    catalog_cache.product_removed(product_id)
+    await shade_registry.refresh()
+    await shade_index.refresh() 
\ No newline at end of file
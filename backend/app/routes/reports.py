@@ -7,7 +7,6 @@ from app.models.product import Product
 from app.models.category import Category
 from app.models.payment import Payment
 from app.utils.auth import get_current_admin_user
-import pandas as pd
 from io import BytesIO
 from app.schemas.user import User
 
@@ -132,7 +131,8 @@ async def export_report(
         report_data = await get_report_data(time_range, current_user)
 
         if format_type == "csv":
-            # Create CSV
+            # Create CSV (pandas is only loaded for exports)
+            import pandas as pd
             df = pd.DataFrame(report_data["sales_data"])
             output = BytesIO()
             df.to_csv(output, index=False)
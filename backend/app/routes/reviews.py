@@ -5,6 +5,7 @@ from bson import ObjectId
 from app.schemas.user import User, UserInDB
 from app.utils.database import get_database
 from app.utils.auth import get_current_user
+from app.utils.catalog_cache import catalog_cache
 from ..models.review import ReviewCreate, ReviewUpdate, ReviewResponse, ReviewStats
 
 router = APIRouter(prefix="/reviews", tags=["reviews"])
@@ -308,6 +309,7 @@ async def update_product_review_stats(product_id: str):
                 {"_id": ObjectId(product_id)},
                 {"$set": {"rating": 0, "reviews": 0}}
             )
+            await catalog_cache.product_changed(product_id)
             return
         
         # Tính toán thống kê
@@ -320,6 +322,7 @@ async def update_product_review_stats(product_id: str):
             {"_id": ObjectId(product_id)},
             {"$set": {"rating": average_rating, "reviews": total_reviews}}
         )
+        await catalog_cache.product_changed(product_id)
         
     except Exception as e:
         print(f"Lỗi khi cập nhật thống kê đánh giá: {str(e)}") 
\ No newline at end of file
@@ -1,103 +1,733 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Form, Depends
-from fastapi.responses import Response
-from PIL import Image
-import io
-from ..utils.virtual_makeup import VirtualMakeupProcessor
+from fastapi import APIRouter, UploadFile, File, HTTPException, Form, Depends, WebSocket, WebSocketDisconnect, Query, Request, status
+from fastapi.responses import Response, JSONResponse
+from pydantic import ValidationError
 from typing import Optional, Literal
-from app.utils.auth import get_current_active_user
+import asyncio
+import json
+import os
+import time
+from app.utils.auth import get_current_user, get_current_active_user, get_current_admin_user
+from app.utils.try_on_quota import try_on_quota
+from app.utils.makeup_pool import makeup_pool
+from app.utils import makeup_tasks
+from app.utils.image_ingest import read_upload, check_image
+from app.utils.image_encode import negotiate_format, media_type_for
+from app.utils.shade_registry import shade_registry
+from app.utils.shade_index import shade_index
+from app.utils.result_cache import result_cache, result_key
+from app.utils.landmark_cache import landmark_cache, landmark_key
+from app.utils.render_presets import RENDER_PRESETS, resolve_preset
+from app.utils.detection_tokens import issue_detection_token, detection_token_covers, DETECTION_TOKEN_TTL
+from app.utils.selfie_sessions import selfie_sessions
+from app.utils.makeup_jobs import makeup_jobs, MAKEUP_JOB_MAX_WAIT
+from app.utils.live_makeup import LiveMakeupSession, live_sessions, reserve_live_slot, release_live_slot, LIVE_MAX_FRAME_BYTES
 from app.schemas.user import UserInDB
+from app.schemas.virtual_makeup import MakeupVariant
 
 router = APIRouter()
-makeup_processor = VirtualMakeupProcessor()
+
+MAKEUP_BATCH_MAX_VARIANTS = int(os.getenv("MAKEUP_BATCH_MAX_VARIANTS", 12))
+# Where job status URLs point (the router is mounted under /api/virtual-makeup)
+JOBS_PATH = "/api/virtual-makeup/try-makeup/jobs"
+
+def server_timing(timings: dict) -> str:
+    """Format per-stage durations (ms) as a Server-Timing header value"""
+    return ", ".join(f"{stage};dur={duration:.1f}" for stage, duration in timings.items())
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header value covers ``etag`` (weak comparison)"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+PresetName = Literal["preview", "standard", "hq"]
+
+def prepare_render(contents: bytes, lips_color, lips_intensity, cheeks_color, cheeks_intensity,
+                   makeup_type, encoding, quality, max_dimension, preset):
+    """Cache key and render_makeup() arguments of a try-on request"""
+    # Resolve colors here so workers receive ready BGR tuples
+    lips_bgr = shade_registry.lookup(lips_color)
+    cheeks_bgr = shade_registry.lookup(cheeks_color)
+    if makeup_type == "lips" or cheeks_intensity <= 0:
+        cheeks_bgr, cheeks_intensity = None, 0  # No cheek color
+    if makeup_type == "cheeks" or lips_intensity <= 0:
+        lips_bgr, lips_intensity = None, 0  # No lip color
+
+    # Identical uploads with the same effective parameters render identically
+    key = result_key(contents, {
+        "lips": [lips_bgr, lips_intensity],
+        "cheeks": [cheeks_bgr, cheeks_intensity],
+        "quality": quality or RENDER_PRESETS[preset]["quality"],
+        "max_side": makeup_tasks.output_side(max_dimension or 0, preset),
+        "max_faces": makeup_tasks.MAKEUP_MAX_FACES,
+        "preset": preset,
+    }, encoding)
+    args = (contents, lips_bgr, lips_intensity, cheeks_bgr, cheeks_intensity, encoding, quality, max_dimension or 0, preset)
+    return key, args
 
 @router.post("/try-makeup")
 async def try_makeup(
+    request: Request,
     image: UploadFile = File(...),
     lips_color: str = Form(...),
     lips_intensity: int = Form(...),
     cheeks_color: str = Form(...),
     cheeks_intensity: int = Form(...),
     makeup_type: Literal["lips", "cheeks", "both"] = Form(...),
+    output_format: Optional[Literal["jpeg", "jpg", "webp", "avif"]] = Form(None),
+    quality: Optional[int] = Form(None, ge=1, le=100),
+    max_dimension: Optional[int] = Form(None, ge=64),
+    preset: Optional[PresetName] = Form(None, description="Quality/speed preset; capped by the membership tier"),
+    session_token: Optional[str] = Form(None, description="Token from /detect-regions; renders of that upload are not counted again"),
     current_user: UserInDB = Depends(get_current_active_user)
 ):
+    reservation = None
     try:
-        # Exempt admins from try-on limits
-        if current_user.role == "admin":
-            is_admin = True
-        else:
-            is_admin = False
-        # Enforce try-on limits based on membership (skip for admin)
-        if not is_admin:
-            membership_limits = {
-                "free": 10,
-                "gold": 50,
-                "diamond": float('inf')
-            }
-            limit = membership_limits.get(current_user.membership, 10)
-            if current_user.try_on_count >= limit:
-                raise HTTPException(status_code=403, detail=f"You have reached your try-on limit for your {current_user.membership} account. Please upgrade to try more.")
+        # Enforce try-on limits based on membership (skip for admin); the
+        # try-on is held until the render succeeds or fails
+        if not session_token:
+            reservation = try_on_quota.check(current_user)
 
-        # Log received parameters
-        print(f"Received parameters: lips_color={lips_color}, lips_intensity={lips_intensity}, cheeks_color={cheeks_color}, cheeks_intensity={cheeks_intensity}, makeup_type={makeup_type}")
-        
-        # Read and validate image
-        contents = await image.read()
+        # Read and validate image: size-capped read, then format and pixel count from the header
+        contents = await read_upload(image)
         if not contents:
             raise HTTPException(status_code=400, detail="No image data received")
+        check_image(contents)
+
+        # A recolor of an upload whose detection was already counted is free
+        covered = bool(session_token) and detection_token_covers(session_token, str(current_user.id), contents)
+        if session_token and not covered:
+            reservation = try_on_quota.check(current_user)
             
-        input_image = Image.open(io.BytesIO(contents))
+        # Output encoding: explicit form field first, then the Accept header
+        encoding = negotiate_format(output_format, request.headers.get("accept"))
+        preset = resolve_preset(preset, current_user)
+        key, render_args = prepare_render(
+            contents, lips_color, lips_intensity, cheeks_color, cheeks_intensity,
+            makeup_type, encoding, quality, max_dimension, preset
+        )
+        etag = f'"{key}"'
+        headers = {
+            "ETag": etag,
+            "Vary": "Accept",
+            "X-Render-Preset": preset,
+            # Results may be kept by the client but must be revalidated
+            "Cache-Control": "private, no-cache",
+        }
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+
+        started = time.perf_counter()
+        result_bytes, tier = await result_cache.get(key)
+        if result_bytes is not None:
+            timings = {f"cache_{tier}": (time.perf_counter() - started) * 1000}
+        else:
+            # Process makeup with provided parameters in the rendering pool; a
+            # photo seen before is rendered with its cached landmarks
+            landmarks_key = landmark_key(contents, makeup_tasks.output_side(max_dimension or 0, preset), preset)
+            result = await makeup_pool.run(makeup_tasks.render_makeup, *render_args, landmark_cache.get(landmarks_key))
+            if result is None:
+                raise HTTPException(status_code=400, detail="Failed to process image")
+            result_bytes, timings, landmarks = result
+            landmark_cache.put(landmarks_key, landmarks)
+            await result_cache.put(key, encoding, result_bytes)
+
+        # After successful try-on, increment try_on_count in the database (skip for admin)
+        if reservation is not None:
+            reservation.consume()
+
+        # Return the image directly
+        return Response(
+            content=result_bytes,
+            media_type=media_type_for(encoding),
+            headers={
+                **headers,
+                "Server-Timing": server_timing(timings),
+                "X-Cache": "HIT" if tier else "MISS",
+            }
+        )
         
-        # Process makeup with provided parameters
-        if makeup_type == "lips":
-            result_image = makeup_processor.apply_makeup(
-                input_image,
-                lips_color,
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error in try_makeup: {str(e)}")  # Add logging
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if reservation is not None:
+            reservation.release()
+
+def job_status(job: dict) -> dict:
+    status_url = f"{JOBS_PATH}/{job['_id']}"
+    body = {
+        "job_id": job["_id"],
+        "status": job["status"],
+        "created_at": job["created_at"].isoformat(),
+        "expires_at": job["expires_at"].isoformat(),
+        "status_url": status_url,
+    }
+    if job["status"] == "done":
+        body["result_url"] = f"{status_url}/result"
+    if job.get("error"):
+        body["error"] = job["error"]
+    return body
+
+async def get_own_job(job_id: str, current_user: UserInDB, wait: float = 0) -> dict:
+    job = await makeup_jobs.get(job_id, wait)
+    if job is None or (job["user_id"] != str(current_user.id) and current_user.role != "admin"):
+        raise HTTPException(status_code=404, detail="Try-on job not found or expired")
+    return job
+
+@router.post("/try-makeup/jobs", status_code=202)
+async def create_try_makeup_job(
+    request: Request,
+    image: UploadFile = File(...),
+    lips_color: str = Form(...),
+    lips_intensity: int = Form(...),
+    cheeks_color: str = Form(...),
+    cheeks_intensity: int = Form(...),
+    makeup_type: Literal["lips", "cheeks", "both"] = Form(...),
+    output_format: Optional[Literal["jpeg", "jpg", "webp", "avif"]] = Form(None),
+    quality: Optional[int] = Form(None, ge=1, le=100),
+    max_dimension: Optional[int] = Form(None, ge=64),
+    preset: Optional[PresetName] = Form(None, description="Quality/speed preset; capped by the membership tier"),
+    current_user: UserInDB = Depends(get_current_active_user)
+):
+    """Queue a try-on render and return its job id without waiting for it.
+
+    Takes the same fields as /try-makeup. Poll ``status_url`` (optionally
+    long-polling with ``?wait=<seconds>``) until the status is ``done`` or
+    ``failed``, then fetch ``result_url``. Jobs and results expire after
+    MAKEUP_JOB_TTL seconds. The try-on is reserved when the job is queued,
+    counted once the render succeeds and given back if it fails; a user can
+    have at most MAKEUP_JOB_MAX_QUEUED_PER_USER unfinished jobs.
+    """
+    try:
+        # Fail fast before reading the upload; the job reserves the try-on itself
+        try_on_quota.check(current_user).release()
+
+        contents = await read_upload(image)
+        if not contents:
+            raise HTTPException(status_code=400, detail="No image data received")
+        check_image(contents)
+
+        encoding = negotiate_format(output_format, request.headers.get("accept"))
+        preset = resolve_preset(preset, current_user)
+        key, render_args = prepare_render(
+            contents, lips_color, lips_intensity, cheeks_color, cheeks_intensity,
+            makeup_type, encoding, quality, max_dimension, preset
+        )
+        landmarks_key = landmark_key(contents, makeup_tasks.output_side(max_dimension or 0, preset), preset)
+        job = await makeup_jobs.submit(
+            current_user, key, encoding, makeup_tasks.render_makeup, *render_args, landmark_cache.get(landmarks_key),
+            landmarks_key=landmarks_key
+        )
+        return JSONResponse(
+            status_code=202,
+            content=job_status(job),
+            headers={"Location": f"{JOBS_PATH}/{job['_id']}"}
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error in create_try_makeup_job: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/try-makeup/jobs/{job_id}")
+async def get_try_makeup_job(
+    job_id: str,
+    wait: float = Query(0, ge=0, le=MAKEUP_JOB_MAX_WAIT, description="Seconds to wait for an unfinished job"),
+    current_user: UserInDB = Depends(get_current_active_user)
+):
+    job = await get_own_job(job_id, current_user, wait)
+    return JSONResponse(content=job_status(job), headers={"Cache-Control": "no-store"})
+
+@router.get("/try-makeup/jobs/{job_id}/result")
+async def get_try_makeup_job_result(job_id: str, current_user: UserInDB = Depends(get_current_active_user)):
+    job = await get_own_job(job_id, current_user)
+    if job["status"] == "failed":
+        raise HTTPException(status_code=422, detail=job.get("error") or "Try-on job failed")
+    if job["status"] != "done":
+        raise HTTPException(
+            status_code=409,
+            detail="Try-on job is not finished yet",
+            headers={"Retry-After": "1"}
+        )
+    result_bytes = await makeup_jobs.read_result(job)
+    if result_bytes is None:
+        raise HTTPException(status_code=410, detail="The try-on result is no longer available; submit the job again")
+    return Response(
+        content=result_bytes,
+        media_type=media_type_for(job["format"]),
+        headers={
+            "ETag": f'"{job["key"]}"',
+            "Cache-Control": "private, no-cache",
+            "Server-Timing": server_timing(job.get("timings") or {}),
+        }
+    )
+
+@router.post("/sessions", status_code=201)
+async def create_selfie_session(
+    image: UploadFile = File(...),
+    max_dimension: Optional[int] = Form(None, ge=64),
+    preset: Optional[PresetName] = Form(None, description="Quality/speed preset; capped by the membership tier"),
+    current_user: UserInDB = Depends(get_current_active_user)
+):
+    """Upload a selfie once for a series of renders.
+
+    The photo is decoded, downscaled to the preset's output size (and at
+    most SELFIE_SESSION_MAX_SIDE) and run through face detection once; renders through
+    /sessions/{session_id}/render then only send the shade. Sessions expire
+    SELFIE_SESSION_TTL seconds after their last use, and starting one beyond
+    SELFIE_SESSIONS_PER_USER drops the user's oldest. Creating a session is
+    not counted as a try-on; every render is.
+    """
+    try:
+        # Free, but only for users with a try-on left
+        try_on_quota.check(current_user).release()
+
+        contents = await read_upload(image)
+        if not contents:
+            raise HTTPException(status_code=400, detail="No image data received")
+        check_image(contents)
+
+        preset = resolve_preset(preset, current_user)
+        session_id = selfie_sessions.new_id()
+        result = await makeup_pool.run(
+            makeup_tasks.create_selfie_session,
+            contents,
+            selfie_sessions.directory,
+            session_id,
+            max_dimension or 0,
+            preset,
+        )
+        if result is None:
+            raise HTTPException(status_code=400, detail="Failed to process image")
+        meta, timings = result
+        meta = await selfie_sessions.add(session_id, str(current_user.id), meta)
+
+        return JSONResponse(
+            status_code=201,
+            content={
+                "session_id": session_id,
+                "width": meta["width"],
+                "height": meta["height"],
+                "faces": meta["faces"],
+                "preset": meta["preset"],
+                "expires_in": selfie_sessions.ttl,
+            },
+            headers={"Server-Timing": server_timing(timings)}
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error in create_selfie_session: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/sessions/{session_id}/render")
+async def render_selfie_session(
+    session_id: str,
+    request: Request,
+    lips_color: str = Form(...),
+    lips_intensity: int = Form(...),
+    cheeks_color: str = Form(...),
+    cheeks_intensity: int = Form(...),
+    makeup_type: Literal["lips", "cheeks", "both"] = Form(...),
+    output_format: Optional[Literal["jpeg", "jpg", "webp", "avif"]] = Form(None),
+    quality: Optional[int] = Form(None, ge=1, le=100),
+    current_user: UserInDB = Depends(get_current_active_user)
+):
+    """Render a shade on a selfie session; the same parameters as /try-makeup, without the image"""
+    reservation = None
+    try:
+        reservation = try_on_quota.check(current_user)
+        session = await selfie_sessions.get(session_id, current_user)
+
+        encoding = negotiate_format(output_format, request.headers.get("accept"))
+        # The session id stands in for the upload; resolution and landmarks are fixed by the session
+        key, render_args = prepare_render(
+            session_id.encode(), lips_color, lips_intensity, cheeks_color, cheeks_intensity,
+            makeup_type, encoding, quality, 0, session["preset"]
+        )
+        _, lips_bgr, lips_intensity, cheeks_bgr, cheeks_intensity, *_ = render_args
+        etag = f'"{key}"'
+        headers = {
+            "ETag": etag,
+            "Vary": "Accept",
+            "X-Render-Preset": session["preset"],
+            "Cache-Control": "private, no-cache",
+        }
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+
+        started = time.perf_counter()
+        result_bytes, tier = await result_cache.get(key)
+        if result_bytes is not None:
+            timings = {f"cache_{tier}": (time.perf_counter() - started) * 1000}
+        else:
+            result = await makeup_pool.run(
+                makeup_tasks.render_selfie_session,
+                selfie_sessions.directory,
+                session_id,
+                lips_bgr,
                 lips_intensity,
-                None,  # No cheek color
-                0,     # No cheek intensity
-            )
-        elif makeup_type == "cheeks":
-            result_image = makeup_processor.apply_makeup(
-                input_image,
-                None,  # No lip color
-                0,     # No lip intensity
-                cheeks_color,
+                cheeks_bgr,
                 cheeks_intensity,
+                encoding,
+                quality,
+                session["preset"],
             )
-        else:  # both
-            result_image = makeup_processor.apply_makeup(
-                input_image,
-                lips_color,
-                lips_intensity,
-                cheeks_color,
-                cheeks_intensity,
+            if result is None:
+                await selfie_sessions.remove(session_id)
+                raise HTTPException(status_code=404, detail="Selfie session not found or expired; upload the photo again")
+            result_bytes, timings = result
+            await result_cache.put(key, encoding, result_bytes)
+
+        reservation.consume()
+
+        return Response(
+            content=result_bytes,
+            media_type=media_type_for(encoding),
+            headers={
+                **headers,
+                "Server-Timing": server_timing(timings),
+                "X-Cache": "HIT" if tier else "MISS",
+            }
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error in render_selfie_session: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if reservation is not None:
+            reservation.release()
+
+@router.delete("/sessions/{session_id}", status_code=204)
+async def delete_selfie_session(session_id: str, current_user: UserInDB = Depends(get_current_active_user)):
+    await selfie_sessions.get(session_id, current_user)
+    await selfie_sessions.remove(session_id)
+    return Response(status_code=204)
+
+@router.post("/recommend-shades")
+async def recommend_shades(
+    image: Optional[UploadFile] = File(None),
+    session_id: Optional[str] = Form(None, description="Selfie session to use instead of uploading a photo"),
+    limit: int = Form(5, ge=1, le=20),
+    current_user: UserInDB = Depends(get_current_active_user)
+):
+    """Suggest lipstick and blush shades from the catalog that suit the user's skin tone.
+
+    The skin tone is the median CIELAB color of cheek and forehead patches
+    found through the face landmarks, from an uploaded photo or an existing
+    selfie session (no detection needed). Shades are the catalog colors
+    nearest to a target offset from the skin tone per makeup type. An
+    uploaded photo counts as one try-on; a selfie session is free.
+    """
+    reservation = None
+    try:
+        if session_id:
+            await selfie_sessions.get(session_id, current_user)
+            result = await makeup_pool.run(
+                makeup_tasks.estimate_session_skin_tone,
+                selfie_sessions.directory,
+                session_id,
             )
-        
-        if result_image is None:
+            if result is None:
+                await selfie_sessions.remove(session_id)
+                raise HTTPException(status_code=404, detail="Selfie session not found or expired; upload the photo again")
+        elif image is not None:
+            reservation = try_on_quota.check(current_user)
+            contents = await read_upload(image)
+            if not contents:
+                raise HTTPException(status_code=400, detail="No image data received")
+            check_image(contents)
+            result = await makeup_pool.run(
+                makeup_tasks.estimate_skin_tone,
+                contents,
+                resolve_preset(None, current_user),
+            )
+            if result is None:
+                raise HTTPException(status_code=400, detail="Failed to process image")
+            reservation.consume()
+        else:
+            raise HTTPException(status_code=400, detail="Send an image or a session_id")
+
+        skin, timings = result
+        if skin is None:
+            raise HTTPException(status_code=422, detail="No face found in the photo")
+        started = time.perf_counter()
+        recommendations = await shade_index.recommend(skin, limit)
+        timings["recommend"] = (time.perf_counter() - started) * 1000
+
+        return JSONResponse(
+            content={
+                "skin_tone": {"L": round(skin[0], 1), "a": round(skin[1], 1), "b": round(skin[2], 1)},
+                "recommendations": recommendations,
+            },
+            headers={"Server-Timing": server_timing(timings), "Cache-Control": "no-store"}
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error in recommend_shades: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if reservation is not None:
+            reservation.release()
+
+@router.post("/detect-regions")
+async def detect_regions(
+    image: UploadFile = File(...),
+    max_dimension: Optional[int] = Form(None, ge=64),
+    include_mask: bool = Form(False),
+    preset: Optional[PresetName] = Form(None, description="Quality/speed preset; capped by the membership tier"),
+    current_user: UserInDB = Depends(get_current_active_user)
+):
+    """Detect faces once and return the makeup regions for client-side recoloring.
+
+    The response holds the lip and cheek polygons (in the coordinates of an
+    image of ``width`` x ``height``) with the blend mode, opacity and blur
+    kernel of each layer, and optionally the blurred alpha masks of the face
+    area as a base64 PNG. The detection counts as one try-on; the returned
+    ``session_token`` lets /try-makeup render the same upload server-side
+    without counting it again.
+    """
+    reservation = None
+    try:
+        reservation = try_on_quota.check(current_user)
+
+        contents = await read_upload(image)
+        if not contents:
+            raise HTTPException(status_code=400, detail="No image data received")
+        check_image(contents)
+
+        preset = resolve_preset(preset, current_user)
+        # The same key as /try-makeup of this upload, so its recolors skip detection
+        landmarks_key = landmark_key(contents, makeup_tasks.output_side(max_dimension or 0, preset), preset)
+        result = await makeup_pool.run(
+            makeup_tasks.detect_regions,
+            contents,
+            max_dimension or 0,
+            include_mask,
+            preset,
+            landmark_cache.get(landmarks_key),
+        )
+        if result is None:
             raise HTTPException(status_code=400, detail="Failed to process image")
-        
-        # Convert the result image to bytes
-        img_byte_arr = io.BytesIO()
-        result_image.save(img_byte_arr, format='JPEG')
-        img_byte_arr.seek(0)
+        regions, timings, landmarks = result
+        landmark_cache.put(landmarks_key, landmarks)
 
-        # After successful try-on, increment try_on_count in the database (skip for admin)
-        if not is_admin:
-            from app.utils.database import get_database
-            db = get_database()
-            await db.users.update_one({"_id": current_user.id}, {"$inc": {"try_on_count": 1}})
+        reservation.consume()
+
+        return JSONResponse(
+            content={
+                **regions,
+                "session_token": issue_detection_token(str(current_user.id), contents),
+                "expires_in": DETECTION_TOKEN_TTL,
+            },
+            headers={
+                "Server-Timing": server_timing(timings),
+                "Cache-Control": "no-store",
+            }
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error in detect_regions: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if reservation is not None:
+            reservation.release()
+
+@router.post("/try-makeup/batch")
+async def try_makeup_batch(
+    request: Request,
+    image: UploadFile = File(...),
+    variants: str = Form(..., description="JSON list of {lips_color, lips_intensity, cheeks_color, cheeks_intensity}"),
+    output_format: Optional[Literal["jpeg", "jpg", "webp", "avif"]] = Form(None),
+    quality: Optional[int] = Form(None, ge=1, le=100),
+    preset: Optional[PresetName] = Form(None, description="Quality/speed preset; capped by the membership tier"),
+    current_user: UserInDB = Depends(get_current_active_user)
+):
+    """Render several shades of one photo with a single face detection.
+
+    Returns one sprite image, encoded in the format negotiated like
+    /try-makeup; the X-Sprite-Manifest header holds the offset of every
+    variant's tile in the same order as ``variants``.
+    """
+    reservation = None
+    try:
+        try:
+            parsed = [MakeupVariant(**variant) for variant in json.loads(variants)]
+        except (ValueError, TypeError, ValidationError) as e:
+            raise HTTPException(status_code=400, detail=f"Invalid variants: {e}")
+        if not parsed:
+            raise HTTPException(status_code=400, detail="At least one variant is required")
+        if len(parsed) > MAKEUP_BATCH_MAX_VARIANTS:
+            raise HTTPException(status_code=400, detail=f"At most {MAKEUP_BATCH_MAX_VARIANTS} variants can be rendered at once")
+
+        # Every variant counts as one try-on
+        reservation = try_on_quota.check(current_user, len(parsed))
+
+        contents = await read_upload(image)
+        if not contents:
+            raise HTTPException(status_code=400, detail="No image data received")
+        check_image(contents)
+
+        encoding = negotiate_format(output_format, request.headers.get("accept"))
+        preset = resolve_preset(preset, current_user)
+        landmarks_key = landmark_key(
+            contents, makeup_tasks.output_side(makeup_tasks.MAKEUP_BATCH_TILE_SIZE, preset), preset
+        )
+        result = await makeup_pool.run(
+            makeup_tasks.render_makeup_batch,
+            contents,
+            [
+                (shade_registry.lookup(v.lips_color), v.lips_intensity,
+                 shade_registry.lookup(v.cheeks_color), v.cheeks_intensity)
+                for v in parsed
+            ],
+            encoding,
+            quality,
+            preset,
+            landmark_cache.get(landmarks_key),
+        )
+        if result is None:
+            raise HTTPException(status_code=400, detail="Failed to process image")
+        sprite_bytes, manifest, landmarks = result
+        landmark_cache.put(landmarks_key, landmarks)
+
+        reservation.consume()
 
-        # Return the image directly
         return Response(
-            content=img_byte_arr.getvalue(),
-            media_type="image/jpeg",
+            content=sprite_bytes,
+            media_type=media_type_for(encoding),
             headers={
+                "Vary": "Accept",
+                "X-Sprite-Manifest": json.dumps(manifest),
                 "Cache-Control": "no-cache, no-store, must-revalidate",
                 "Pragma": "no-cache",
                 "Expires": "0"
             }
         )
-        
+
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error in try_makeup: {str(e)}")  # Add logging
-        raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
+        print(f"Error in try_makeup_batch: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if reservation is not None:
+            reservation.release()
+
+@router.websocket("/live")
+async def live_makeup(websocket: WebSocket, token: str = Query(...)):
+    """Live camera try-on.
+
+    The client sends JPEG frames as binary messages and shade settings as
+    JSON text messages ({"lips_color", "lips_intensity", "cheeks_color",
+    "cheeks_intensity"}); rendered frames come back as binary messages.
+    Sending {"type": "stats"} returns the session statistics as JSON.
+    A live session counts as a single try-on.
+    """
+    try:
+        current_user = await get_current_active_user(await get_current_user(token))
+        reservation = try_on_quota.check(current_user)
+    except HTTPException as e:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=str(e.detail))
+        return
+    # Claimed before any await, so connections arriving together cannot all pass the cap
+    if not reserve_live_slot():
+        reservation.release()
+        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER, reason="Live try-on is busy")
+        return
+
+    try:
+        with reservation:
+            await websocket.accept()
+            # Loading MediaPipe and building the FaceMesh graph would block the event loop
+            session = await asyncio.to_thread(LiveMakeupSession, str(current_user.id))
+            live_sessions[session.id] = session
+            reservation.consume()
+    finally:
+        release_live_slot()
+
+    async def receive_frames():
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            if message.get("bytes") is not None:
+                if len(message["bytes"]) <= LIVE_MAX_FRAME_BYTES:
+                    session.push_frame(message["bytes"])
+            elif message.get("text"):
+                try:
+                    params = json.loads(message["text"])
+                    if not isinstance(params, dict):
+                        raise ValueError("expected a JSON object")
+                except ValueError as e:
+                    await websocket.send_json({"error": f"Invalid message: {e}"})
+                    continue
+                if params.get("type") == "stats":
+                    await websocket.send_json(session.stats())
+                    continue
+                try:
+                    session.set_shade(params)
+                except (ValueError, TypeError) as e:
+                    await websocket.send_json({"error": f"Invalid shade: {e}"})
+
+    async def send_frames():
+        while True:
+            data, received_at = await session.next_frame()
+            rendered = await session.render(data)
+            if rendered is not None:
+                await websocket.send_bytes(rendered)
+                session.record_sent(received_at)
+
+    tasks = [asyncio.create_task(receive_frames()), asyncio.create_task(send_frames())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            error = task.exception()
+            if error is not None and not isinstance(error, WebSocketDisconnect):
+                print(f"Error in live_makeup: {error}")
+    finally:
+        for task in tasks:
+            task.cancel()
+        live_sessions.pop(session.id, None)
+        await asyncio.to_thread(session.close)
+
+@router.get("/presets")
+async def get_render_presets(current_user: UserInDB = Depends(get_current_active_user)):
+    """Render presets, and the one used by default and the best one allowed for the current user"""
+    return {
+        "presets": RENDER_PRESETS,
+        "default": resolve_preset(None, current_user),
+        "best": resolve_preset("hq", current_user),
+    }
+
+@router.get("/live/stats")
+async def get_live_stats(current_user: UserInDB = Depends(get_current_admin_user)):
+    return [session.stats() for session in live_sessions.values()]
+
+@router.get("/stats")
+async def get_makeup_stats(current_user: UserInDB = Depends(get_current_admin_user)):
+    return {
+        **makeup_pool.stats(),
+        "try_on_quota": try_on_quota.stats(),
+        "result_cache": result_cache.stats(),
+        "landmark_cache": landmark_cache.stats(),
+        "jobs": makeup_jobs.stats(),
+        "selfie_sessions": selfie_sessions.stats(),
+    }
+
+@router.get("/metrics")
+async def get_makeup_metrics(current_user: UserInDB = Depends(get_current_admin_user)):
+    """Stage latency and image size histograms, face and error counters, summed over all render workers"""
+    return makeup_pool.stats().get("metrics", {})
\ No newline at end of file
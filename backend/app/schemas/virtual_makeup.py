@@ -0,0 +1,8 @@
+from pydantic import BaseModel, Field
+from typing import Optional
+
+class MakeupVariant(BaseModel):
+    lips_color: Optional[str] = None
+    lips_intensity: int = Field(0, ge=0, le=100)
+    cheeks_color: Optional[str] = None
+    cheeks_intensity: int = Field(0, ge=0, le=100)
@@ -45,7 +45,8 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> UserInDB:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("sub")
-        if user_id is None:
+        # Scoped tokens (e.g. makeup detection tokens) are not login tokens
+        if user_id is None or "scope" in payload:
             raise credentials_exception
     except JWTError:
         raise credentials_exception
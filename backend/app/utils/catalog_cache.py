@@ -0,0 +1,122 @@
+import asyncio
+import os
+import time
+from bson import ObjectId
+from app.utils.database import get_database
+
+# Seconds before the whole catalog is re-read, picking up writes made through other API workers
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", 300))
+
+# Storefront sort options: (field, descending)
+CATALOG_SORTS = {
+    "newest": ("created_at", True),
+    "price-asc": ("price", False),
+    "price-desc": ("price", True),
+    "name-asc": ("name", False),
+}
+
+# Fields that decide which listings a product appears in and where
+_LISTING_FIELDS = ("is_active", "category", "created_at", "price", "name")
+
+
+def _sort_key(field: str):
+    # Like Mongo, documents missing the field sort before every value
+    return lambda product: (product.get(field) is not None, product.get(field))
+
+
+class CatalogCache:
+    """In-process copy of the product catalog for storefront reads.
+
+    Holds every product document by id, plus the ordered ids of the active
+    products for each (category, sort) pair, built on first use. Every
+    product write path updates it through put(), product_changed() or
+    product_removed(), so storefront listings and detail pages are served
+    without touching Mongo. Writes made through another API worker are
+    picked up when the catalog is re-read, at most CATALOG_CACHE_TTL
+    seconds later.
+    """
+
+    def __init__(self, ttl: float = CATALOG_CACHE_TTL):
+        self.ttl = ttl
+        self._products = {}  # id -> product document
+        self._listings = {}  # (category, sort) -> ordered ids of active products
+        self._loaded_at = None
+        self._lock = asyncio.Lock()
+        self.hits = 0
+        self.loads = 0
+
+    async def load(self):
+        """Read the whole catalog"""
+        db = get_database()
+        products = await db.products.find().to_list(length=None)
+        self._products = {str(product["_id"]): product for product in products}
+        self._listings = {}
+        self._loaded_at = time.monotonic()
+        self.loads += 1
+
+    async def _ensure_loaded(self):
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl:
+            return
+        async with self._lock:
+            # Another request may have reloaded while we waited
+            if self._loaded_at is None or time.monotonic() - self._loaded_at >= self.ttl:
+                await self.load()
+
+    def _listing(self, category, sort: str) -> list:
+        key = (category, sort)
+        ids = self._listings.get(key)
+        if ids is None:
+            field, descending = CATALOG_SORTS[sort]
+            products = [
+                product for product in self._products.values()
+                if product.get("is_active") is True and (category is None or product.get("category") == category)
+            ]
+            products.sort(key=_sort_key(field), reverse=descending)
+            ids = self._listings[key] = [str(product["_id"]) for product in products]
+        return ids
+
+    async def page(self, category, sort: str, skip: int, limit: int):
+        """(total count, product documents) of one storefront page; ``category`` None means all"""
+        await self._ensure_loaded()
+        self.hits += 1
+        ids = self._listing(category, sort if sort in CATALOG_SORTS else "newest")
+        return len(ids), [self._products[product_id] for product_id in ids[skip:skip + limit]]
+
+    async def get(self, product_id: str):
+        """A product document by id (active or not), or None"""
+        await self._ensure_loaded()
+        self.hits += 1
+        return self._products.get(product_id)
+
+    async def product_changed(self, product_id):
+        """Re-read one product after a write that did not read it back (stock, rating)"""
+        db = get_database()
+        product = await db.products.find_one({"_id": ObjectId(str(product_id))})
+        if product is None:
+            self.product_removed(product_id)
+        else:
+            self.put(product)
+
+    def put(self, product: dict):
+        """Store a product document just written and read back by a route"""
+        product_id = str(product["_id"])
+        previous = self._products.get(product_id)
+        self._products[product_id] = product
+        # Stock or rating changes keep every listing's order
+        if previous is None or any(previous.get(field) != product.get(field) for field in _LISTING_FIELDS):
+            self._listings = {}
+
+    def product_removed(self, product_id):
+        if self._products.pop(str(product_id), None) is not None:
+            self._listings = {}
+
+    def stats(self) -> dict:
+        return {
+            "products": len(self._products),
+            "listings": len(self._listings),
+            "hits": self.hits,
+            "loads": self.loads,
+        }
+
+
+catalog_cache = CatalogCache()
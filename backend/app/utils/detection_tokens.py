@@ -0,0 +1,51 @@
+import hashlib
+import os
+from datetime import datetime, timedelta
+from jose import JWTError, jwt
+from app.utils.auth import SECRET_KEY, ALGORITHM
+
+# Lifetime of the token returned by /detect-regions, in seconds
+DETECTION_TOKEN_TTL = int(os.getenv("DETECTION_TOKEN_TTL", 1800))
+# Detection tokens are signed with their own key, so they can never pass as login tokens
+DETECTION_TOKEN_SECRET = os.getenv("DETECTION_TOKEN_SECRET") or hashlib.blake2b(
+    SECRET_KEY.encode(), key=b"makeup-detection-token", digest_size=32
+).hexdigest()
+
+_SCOPE = "makeup-detection"
+
+
+def image_digest(contents: bytes) -> str:
+    return hashlib.blake2b(contents, digest_size=20).hexdigest()
+
+
+def issue_detection_token(user_id: str, contents: bytes) -> str:
+    """Signed token proving ``user_id`` already paid a try-on for detecting faces in ``contents``.
+
+    Stateless, so any API worker can check it. Server-side renders of the
+    same upload that present it are not counted again. The user is named
+    in ``uid`` rather than ``sub`` and the token carries a ``scope``, so
+    get_current_user() rejects it even if the keys were the same.
+    """
+    return jwt.encode(
+        {
+            "uid": user_id,
+            "scope": _SCOPE,
+            "img": image_digest(contents),
+            "exp": datetime.utcnow() + timedelta(seconds=DETECTION_TOKEN_TTL),
+        },
+        DETECTION_TOKEN_SECRET,
+        algorithm=ALGORITHM,
+    )
+
+
+def detection_token_covers(token: str, user_id: str, contents: bytes) -> bool:
+    """Whether ``token`` is a live detection token of ``user_id`` for this exact upload"""
+    try:
+        payload = jwt.decode(token, DETECTION_TOKEN_SECRET, algorithms=[ALGORITHM])
+    except JWTError:
+        return False
+    return (
+        payload.get("scope") == _SCOPE
+        and payload.get("uid") == user_id
+        and payload.get("img") == image_digest(contents)
+    )
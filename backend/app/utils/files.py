@@ -0,0 +1,21 @@
+import os
+import threading
+
+
+def atomic_write(path: str, data: bytes):
+    """Write ``data`` to ``path`` through a temporary file, so readers never see a partial file.
+
+    The temporary name is unique per process and thread and ends in
+    ``.tmp``; it is removed again if the write fails.
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
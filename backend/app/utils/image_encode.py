@@ -0,0 +1,81 @@
+import io
+import os
+from PIL import Image, features
+
+# Default quality for encoded try-on results (1-100)
+MAKEUP_OUTPUT_QUALITY = int(os.getenv("MAKEUP_OUTPUT_QUALITY", 80))
+
+# Output format name -> (PIL format, media type)
+OUTPUT_FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg"),
+    "webp": ("WEBP", "image/webp"),
+    "avif": ("AVIF", "image/avif"),
+}
+
+# Preferred order when the client only tells us what it accepts
+_PREFERENCE = ["avif", "webp", "jpeg"]
+
+# Formats OpenCV encodes straight from a BGR array: (extension, quality flag)
+_OPENCV_FORMATS = {
+    "jpeg": (".jpg", "IMWRITE_JPEG_QUALITY"),
+    "webp": (".webp", "IMWRITE_WEBP_QUALITY"),
+}
+
+
+def _pil_can_save(pil_format: str) -> bool:
+    Image.init()
+    return pil_format in Image.SAVE
+
+
+def available_formats() -> list:
+    """Output formats this Pillow build can encode (AVIF needs libavif or pillow-avif-plugin)"""
+    formats = ["jpeg"]
+    if features.check("webp") and _pil_can_save("WEBP"):
+        formats.append("webp")
+    if _pil_can_save("AVIF"):
+        formats.append("avif")
+    return formats
+
+
+def negotiate_format(requested, accept_header) -> str:
+    """Pick the output format from an explicit request or the Accept header.
+
+    An explicitly requested format wins if it can be encoded; otherwise the
+    best format listed in Accept is used, falling back to JPEG.
+    """
+    formats = available_formats()
+    if requested:
+        requested = requested.lower().replace("jpg", "jpeg")
+        if requested in formats:
+            return requested
+    accept = (accept_header or "").lower()
+    for name in _PREFERENCE:
+        if name in formats and OUTPUT_FORMATS[name][1] in accept:
+            return name
+    return "jpeg"
+
+
+def media_type_for(output_format: str) -> str:
+    return OUTPUT_FORMATS[output_format][1]
+
+
+def encode_image(image, output_format: str = "jpeg", quality: int = None) -> bytes:
+    """Encode a BGR array in the given output format.
+
+    JPEG and WebP are encoded by OpenCV directly from the BGR buffer, with
+    no color conversion or intermediate image; AVIF goes through Pillow.
+    """
+    import cv2
+
+    quality = quality or MAKEUP_OUTPUT_QUALITY
+    if output_format in _OPENCV_FORMATS:
+        extension, quality_flag = _OPENCV_FORMATS[output_format]
+        ok, encoded = cv2.imencode(extension, image, [getattr(cv2, quality_flag), quality])
+        if not ok:
+            raise ValueError(f"Could not encode image as {output_format}")
+        return encoded.tobytes()
+
+    pil_format = OUTPUT_FORMATS[output_format][0]
+    img_byte_arr = io.BytesIO()
+    Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB)).save(img_byte_arr, format=pil_format, quality=quality)
+    return img_byte_arr.getvalue()
@@ -0,0 +1,167 @@
+import io
+import os
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+# Longest side FaceMesh is run on; landmarks are rescaled to the full image
+MAKEUP_DETECTION_MAX_SIDE = int(os.getenv("MAKEUP_DETECTION_MAX_SIDE", 640))
+# Longest side of rendered try-on results, 0 keeps the uploaded resolution
+MAKEUP_MAX_OUTPUT_SIDE = int(os.getenv("MAKEUP_MAX_OUTPUT_SIDE", 0))
+# Uploads larger than this are rejected, from Content-Length before the body is received when possible
+MAKEUP_MAX_UPLOAD_BYTES = int(os.getenv("MAKEUP_MAX_UPLOAD_MB", 15)) * 1024 * 1024
+# Images with more pixels than this are rejected from their header, before decoding
+MAKEUP_MAX_UPLOAD_PIXELS = int(os.getenv("MAKEUP_MAX_UPLOAD_PIXELS", 50_000_000))
+
+# Upload formats accepted for try-on, as identified by Pillow (MPO is a multi-frame JPEG)
+ACCEPTED_FORMATS = {"JPEG", "MPO", "PNG", "WEBP"}
+
+_UPLOAD_CHUNK_SIZE = 256 * 1024
+# Room in a multipart request body for the boundaries and the other form fields
+_FORM_OVERHEAD_BYTES = 64 * 1024
+
+
+def _too_large(max_bytes: int) -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"Image is too large; at most {max_bytes / (1024 * 1024):g} MB can be uploaded"
+    )
+
+
+class UploadSizeLimit:
+    """ASGI middleware rejecting oversized POST bodies under ``path_prefix`` before they are parsed.
+
+    FastAPI parses a multipart body, spooling the upload to a temporary
+    file, before the route runs, so read_upload() alone cannot stop a large
+    upload from being received. Requests whose Content-Length exceeds the
+    upload cap (plus room for the other form fields) get a 413 before any
+    of the body is read; bodies without a Content-Length fail with 413 as
+    soon as they have streamed past it.
+    """
+
+    def __init__(self, app, path_prefix: str, max_bytes: int = MAKEUP_MAX_UPLOAD_BYTES):
+        self.app = app
+        self.path_prefix = path_prefix
+        self.max_bytes = max_bytes
+        self.max_body = max_bytes + _FORM_OVERHEAD_BYTES
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not scope["path"].startswith(self.path_prefix):
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_body:
+            error = _too_large(self.max_bytes)
+            response = JSONResponse(status_code=error.status_code, content={"detail": error.detail},
+                                    headers={"Connection": "close"})
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body:
+                    raise _too_large(self.max_bytes)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+async def read_upload(upload, max_bytes: int = MAKEUP_MAX_UPLOAD_BYTES) -> bytes:
+    """Read an uploaded file into memory, failing with 413 if it exceeds ``max_bytes``.
+
+    By the time a route runs the whole body has been received, so this is
+    a cap on what is kept, not early rejection; UploadSizeLimit turns
+    oversized requests away before they are received. The file is read in
+    chunks so no more than ``max_bytes`` is held in memory.
+    """
+    too_large = _too_large(max_bytes)
+    size = getattr(upload, "size", None)
+    if size is not None and size > max_bytes:
+        raise too_large
+
+    chunks = []
+    received = 0
+    while True:
+        chunk = await upload.read(_UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        received += len(chunk)
+        if received > max_bytes:
+            raise too_large
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def probe_image(contents: bytes):
+    """(format, width, height) of an image read from its header, without decoding the pixels"""
+    from PIL import Image
+
+    try:
+        with Image.open(io.BytesIO(contents)) as image:
+            return image.format, image.width, image.height
+    except Image.DecompressionBombError as e:
+        raise ValueError(str(e))
+
+
+def check_image(contents: bytes, max_pixels: int = MAKEUP_MAX_UPLOAD_PIXELS):
+    """Validate an upload from its header before it is decoded.
+
+    Raises 400 for unreadable data, 415 for unsupported formats and 413 for
+    images with more than ``max_pixels`` pixels. Returns (format, width, height).
+    """
+    try:
+        image_format, width, height = probe_image(contents)
+    except (OSError, ValueError):
+        raise HTTPException(status_code=400, detail="Could not read the image")
+    if image_format not in ACCEPTED_FORMATS:
+        raise HTTPException(
+            status_code=415,
+            detail="Unsupported image format; upload a JPEG, PNG or WebP image"
+        )
+    if width * height > max_pixels:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Image is too large ({width}x{height}); at most {max_pixels / 1_000_000:g} megapixels are accepted"
+        )
+    return image_format, width, height
+
+
+def decode_image(contents: bytes, max_side: int = 0):
+    """Decode an uploaded image straight to an upright BGR array no larger than ``max_side``.
+
+    The header is probed first and anything check_image() would reject
+    raises ValueError before decoding. When the image is at least twice as
+    large as needed, OpenCV's IMREAD_REDUCED_* modes let libjpeg scale by
+    1/2, 1/4 or 1/8 during decoding instead of decoding full size and
+    shrinking afterwards. imdecode applies EXIF orientation, so phone photos
+    are not sideways.
+    """
+    import cv2
+    import numpy as np
+
+    image_format, width, height = probe_image(contents)
+    if image_format not in ACCEPTED_FORMATS:
+        raise ValueError(f"Unsupported image format {image_format}")
+    if width * height > MAKEUP_MAX_UPLOAD_PIXELS:
+        raise ValueError(f"Image is too large ({width}x{height})")
+
+    flags = cv2.IMREAD_COLOR
+    if max_side:
+        for factor, reduced in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)):
+            if max(width, height) // factor >= max_side:
+                flags = reduced
+                break
+    image = cv2.imdecode(np.frombuffer(contents, dtype=np.uint8), flags)
+    if image is None:
+        raise ValueError("Could not decode image")
+
+    h, w = image.shape[:2]
+    if max_side and max(h, w) > max_side:
+        scale = max_side / max(h, w)
+        image = cv2.resize(image, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+    return image
@@ -0,0 +1,103 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+
+# Landmark cache configuration
+LANDMARK_CACHE_ENTRIES = int(os.getenv("LANDMARK_CACHE_ENTRIES", 512))
+LANDMARK_CACHE_MAX_BYTES = int(os.getenv("LANDMARK_CACHE_MAX_MB", 16)) * 1024 * 1024
+LANDMARK_CACHE_TTL = float(os.getenv("LANDMARK_CACHE_TTL", 900))  # seconds
+
+
+def landmark_key(contents: bytes, max_side: int, preset: str) -> str:
+    """Cache key of an upload's landmarks: hash of the uploaded bytes and everything detection depends on"""
+    from app.utils.makeup_tasks import MAKEUP_MAX_FACES
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(hashlib.blake2b(contents, digest_size=20).digest())
+    # Landmarks are in the coordinates of the image decoded at max_side
+    digest.update(f"{max_side}:{preset}:{MAKEUP_MAX_FACES}".encode())
+    return digest.hexdigest()
+
+
+class LandmarkCache:
+    """LRU + TTL cache of FaceMesh landmarks.
+
+    Landmarks are stored as read-only int32 arrays of shape (K, N, 2), one
+    row per face. Images in which no face was found are cached as an empty
+    array so that repeated uploads of them skip detection as well.
+
+    The API process keeps one, keyed by landmark_key() of the upload, and
+    passes the landmarks of a known photo along with the render, so a shade
+    change skips detection whichever pool worker renders it. A processor
+    given its own cache keys it by decoded pixels (key_for()).
+    """
+
+    def __init__(self, max_entries: int = LANDMARK_CACHE_ENTRIES,
+                 max_bytes: int = LANDMARK_CACHE_MAX_BYTES,
+                 ttl: float = LANDMARK_CACHE_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, landmarks)
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key_for(image) -> str:
+        """Hash of the decoded pixels, so re-encoded uploads of the same photo still hit."""
+        import numpy as np
+
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(repr((image.shape, image.dtype.str)).encode())
+        digest.update(np.ascontiguousarray(image).data)
+        return digest.hexdigest()
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, landmarks = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return landmarks
+
+    def put(self, key: str, landmarks):
+        import numpy as np
+
+        landmarks = np.ascontiguousarray(landmarks, dtype=np.int32)
+        landmarks.setflags(write=False)
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + self.ttl, landmarks)
+        self._bytes += landmarks.nbytes
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: str):
+        _, landmarks = self._entries.pop(key)
+        self._bytes -= landmarks.nbytes
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+landmark_cache = LandmarkCache()
@@ -0,0 +1,179 @@
+import asyncio
+import os
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Live (WebSocket) try-on configuration
+LIVE_MAX_SESSIONS = int(os.getenv("LIVE_MAKEUP_MAX_SESSIONS", 4))
+LIVE_MAX_FRAME_BYTES = int(os.getenv("LIVE_MAKEUP_MAX_FRAME_KB", 512)) * 1024
+# Frames with more pixels than this are dropped from their header, before decoding
+LIVE_MAX_FRAME_PIXELS = int(os.getenv("LIVE_MAKEUP_MAX_FRAME_PIXELS", 1280 * 720))
+LIVE_JPEG_QUALITY = int(os.getenv("LIVE_MAKEUP_JPEG_QUALITY", 75))
+
+# Active sessions by id, for the stats endpoint
+live_sessions = {}
+# Sessions still being set up, counted against LIVE_MAX_SESSIONS until registered
+_starting = 0
+
+
+def reserve_live_slot() -> bool:
+    """Claim a session slot before the session is built, or False if all are taken"""
+    global _starting
+    if len(live_sessions) + _starting >= LIVE_MAX_SESSIONS:
+        return False
+    _starting += 1
+    return True
+
+
+def release_live_slot():
+    """Give back a slot claimed by reserve_live_slot(), once the session is registered or failed"""
+    global _starting
+    _starting -= 1
+
+
+def _percentile(values, percent):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class LiveMakeupSession:
+    """Per-connection state of a live camera try-on.
+
+    Each session owns a FaceMesh in tracking mode (landmarks from the previous
+    frame seed the next one) and a single render thread. Only the newest
+    frame is kept while a render is in flight; older ones are dropped so a
+    slow client never builds up a backlog.
+    """
+
+    def __init__(self, user_id: str):
+        from app.utils.virtual_makeup import VirtualMakeupProcessor
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.processor = VirtualMakeupProcessor(static_image_mode=False)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"live-makeup-{self.id[:8]}")
+        self.lips_bgr = None
+        self.lips_intensity = 0
+        self.cheeks_bgr = None
+        self.cheeks_intensity = 0
+        self.started_at = time.time()
+        self.frames_received = 0
+        self.frames_rendered = 0
+        self.frames_dropped = 0
+        self.frames_rejected = 0
+        self.faces_missed = 0
+        self._latest = None  # (jpeg bytes, monotonic receive time)
+        self._frame_ready = asyncio.Event()
+        self._sent_at = deque(maxlen=30)
+        self._latency_ms = deque(maxlen=100)
+
+    def set_shade(self, params: dict):
+        """Update the shade from a client message.
+
+        Raises ValueError naming the first invalid field; the shade is then
+        left unchanged.
+        """
+        shade = {}
+        for prefix in ("lips", "cheeks"):
+            color = params.get(f"{prefix}_color")
+            if color is not None:
+                if not isinstance(color, str):
+                    raise ValueError(f"{prefix}_color must be a string")
+                shade[f"{prefix}_bgr"] = self.processor.parse_color_to_bgr(color)
+            if f"{prefix}_intensity" in params:
+                intensity = params[f"{prefix}_intensity"]
+                if isinstance(intensity, bool) or not isinstance(intensity, (int, float, str)):
+                    raise ValueError(f"{prefix}_intensity must be a number from 0 to 100")
+                try:
+                    intensity = int(float(intensity))
+                except (ValueError, OverflowError):
+                    raise ValueError(f"{prefix}_intensity must be a number from 0 to 100")
+                shade[f"{prefix}_intensity"] = max(0, min(100, intensity))
+        for name, value in shade.items():
+            setattr(self, name, value)
+
+    def push_frame(self, data: bytes):
+        """Keep only the newest frame; a frame not yet picked up is dropped"""
+        self.frames_received += 1
+        if self._latest is not None:
+            self.frames_dropped += 1
+        self._latest = (data, time.monotonic())
+        self._frame_ready.set()
+
+    async def next_frame(self):
+        await self._frame_ready.wait()
+        self._frame_ready.clear()
+        frame, self._latest = self._latest, None
+        return frame
+
+    def render_frame(self, data: bytes):
+        """Decode a JPEG frame, apply the current shade and re-encode it (runs in the render thread)
+
+        Frames are probed like uploads first: unreadable ones, other formats
+        and frames over LIVE_MAX_FRAME_PIXELS are dropped without decoding.
+        """
+        import cv2
+        import numpy as np
+        from app.utils.image_ingest import probe_image, ACCEPTED_FORMATS
+
+        try:
+            image_format, width, height = probe_image(data)
+        except (OSError, ValueError):
+            image_format, width, height = None, 0, 0
+        if image_format not in ACCEPTED_FORMATS or width * height > LIVE_MAX_FRAME_PIXELS:
+            self.frames_rejected += 1
+            return None
+
+        frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            self.frames_rejected += 1
+            return None
+        landmarks = self.processor.detect_landmarks(frame)
+        if landmarks is None:
+            self.faces_missed += 1
+        else:
+            self.processor.apply_makeup_to_landmarks(
+                frame, landmarks,
+                self.lips_bgr, self.lips_intensity, self.cheeks_bgr, self.cheeks_intensity
+            )
+        ok, encoded = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, LIVE_JPEG_QUALITY])
+        return encoded.tobytes() if ok else None
+
+    async def render(self, data: bytes):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.render_frame, data)
+
+    def record_sent(self, received_at: float):
+        now = time.monotonic()
+        self.frames_rendered += 1
+        self._sent_at.append(now)
+        self._latency_ms.append((now - received_at) * 1000)
+
+    def stats(self) -> dict:
+        fps = None
+        if len(self._sent_at) > 1 and self._sent_at[-1] > self._sent_at[0]:
+            fps = round((len(self._sent_at) - 1) / (self._sent_at[-1] - self._sent_at[0]), 1)
+        latencies = list(self._latency_ms)
+        p50 = _percentile(latencies, 50)
+        p95 = _percentile(latencies, 95)
+        return {
+            "session_id": self.id,
+            "user_id": self.user_id,
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            "fps": fps,
+            "latency_ms_p50": round(p50, 1) if p50 is not None else None,
+            "latency_ms_p95": round(p95, 1) if p95 is not None else None,
+            "frames_received": self.frames_received,
+            "frames_rendered": self.frames_rendered,
+            "frames_dropped": self.frames_dropped,
+            "frames_rejected": self.frames_rejected,
+            "faces_missed": self.faces_missed,
+        }
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.processor.close()
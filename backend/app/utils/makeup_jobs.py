@@ -0,0 +1,278 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from fastapi import HTTPException, status
+from app.utils.database import get_database
+from app.utils.landmark_cache import landmark_cache
+from app.utils.makeup_pool import makeup_pool
+from app.utils.result_cache import result_cache
+from app.utils.try_on_quota import try_on_quota
+
+logger = logging.getLogger(__name__)
+
+# Seconds a finished job and its result stay available
+MAKEUP_JOB_TTL = int(os.getenv("MAKEUP_JOB_TTL", 600))
+# Jobs waiting for a render slot on this API worker before new ones get 503
+MAKEUP_JOB_MAX_QUEUED = int(os.getenv("MAKEUP_JOB_MAX_QUEUED", 64))
+# Unfinished jobs one user may have on this API worker before new ones get 429
+MAKEUP_JOB_MAX_QUEUED_PER_USER = int(os.getenv("MAKEUP_JOB_MAX_QUEUED_PER_USER", 4))
+# Seconds a job may wait for the rendering pool before it is failed
+MAKEUP_JOB_TIMEOUT = float(os.getenv("MAKEUP_JOB_TIMEOUT", 300))
+# Longest long-poll a client may ask for, in seconds
+MAKEUP_JOB_MAX_WAIT = float(os.getenv("MAKEUP_JOB_MAX_WAIT", 25))
+# How often a long-poll re-reads a job rendered by another API worker
+_POLL_INTERVAL = 0.5
+# Largest result kept: a Mongo document holds at most 16 MB, with room left for its other fields
+_MAX_RESULT_BYTES = 16 * 1024 * 1024 - 64 * 1024
+
+COLLECTION = "makeup_jobs"
+# Rendered images of finished jobs, by job id
+RESULTS_COLLECTION = "makeup_job_results"
+
+
+class MakeupJobs:
+    """Background try-on renders whose state lives in Mongo.
+
+    Submitting inserts a ``queued`` job document and returns at once; the
+    render runs in the MakeupPool from a task on this API worker. Unlike
+    direct requests, jobs do not get a 503 when the pool is saturated: they
+    wait for a slot (up to MAKEUP_JOB_TIMEOUT) and only the number of jobs
+    waiting here is bounded, overall and per user. Submitting reserves the
+    user's try-on, which is counted when the render succeeds and given back
+    when it fails. The job document only holds the status, so polling
+    stays cheap; the finished image goes to a separate document with the
+    job id in RESULTS_COLLECTION, so any API worker on any host can report
+    the job and serve its result. TTL indexes on ``expires_at`` remove both
+    MAKEUP_JOB_TTL seconds after the job finishes.
+    """
+
+    def __init__(self, ttl: int = MAKEUP_JOB_TTL, max_queued: int = MAKEUP_JOB_MAX_QUEUED,
+                 timeout: float = MAKEUP_JOB_TIMEOUT, max_queued_per_user: int = MAKEUP_JOB_MAX_QUEUED_PER_USER):
+        self.ttl = ttl
+        self.max_queued = max_queued
+        self.max_queued_per_user = max_queued_per_user
+        self.timeout = timeout
+        self._tasks = {}  # job id -> render task on this worker
+        self._queued_by_user = {}  # user id -> number of its tasks on this worker
+        self._finished = {}  # job id -> Event set when a local job finishes
+        self.submitted = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.rejected = 0
+
+    async def start(self):
+        db = get_database()
+        await db[COLLECTION].create_index("expires_at", expireAfterSeconds=0)
+        await db[RESULTS_COLLECTION].create_index("expires_at", expireAfterSeconds=0)
+
+    async def stop(self):
+        """Cancel local renders; their jobs are stored as failed"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _store_result(self, job_id: str, data: bytes, expires_at: datetime):
+        """Keep a finished job's image in Mongo until the job expires"""
+        if len(data) > _MAX_RESULT_BYTES:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail="The try-on result is too large to keep; use a smaller max_dimension"
+            )
+        await get_database()[RESULTS_COLLECTION].replace_one(
+            {"_id": job_id},
+            {"_id": job_id, "data": data, "expires_at": expires_at},
+            upsert=True
+        )
+
+    def _expiry(self) -> datetime:
+        return datetime.utcnow() + timedelta(seconds=self.ttl)
+
+    async def submit(self, user, key: str, output_format: str, fn, *args, landmarks_key: str = None,
+                     charge: bool = True) -> dict:
+        """Create a job rendering ``fn(*args)`` in the pool and return its document (without result).
+
+        ``fn`` returns (image_bytes, timings, landmarks) like render_makeup;
+        the landmarks are cached under ``landmarks_key`` if given. ``key`` is
+        the result_key() of the render: a cached result finishes the job
+        immediately. With ``charge`` one try-on of the user is
+        reserved now (403 if none is left), counted once the render succeeds
+        and released if it fails.
+        """
+        user_id = str(user.id)
+        if len(self._tasks) >= self.max_queued:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many try-on jobs are waiting. Please try again shortly.",
+                headers={"Retry-After": str(makeup_pool.retry_after)}
+            )
+        if self._queued_by_user.get(user_id, 0) >= self.max_queued_per_user:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail=f"You already have {self.max_queued_per_user} try-on jobs in progress. Please wait for them to finish.",
+                headers={"Retry-After": str(makeup_pool.retry_after)}
+            )
+        reservation = try_on_quota.check(user) if charge else None
+        try:
+            return await self._submit(user_id, reservation, landmarks_key, key, output_format, fn, *args)
+        except BaseException:
+            if reservation is not None:
+                reservation.release()
+            raise
+
+    async def _submit(self, user_id: str, reservation, landmarks_key, key: str, output_format: str, fn, *args) -> dict:
+
+        now = datetime.utcnow()
+        job = {
+            "_id": uuid.uuid4().hex,
+            "user_id": user_id,
+            "status": "queued",
+            "key": key,
+            "format": output_format,
+            "created_at": now,
+            # Unfinished jobs are also cleaned up eventually
+            "expires_at": now + timedelta(seconds=self.timeout + self.ttl),
+        }
+        self.submitted += 1
+
+        cached, tier = await result_cache.get(key)
+        if cached is not None:
+            job.update(status="done", timings={f"cache_{tier}": 0.0}, expires_at=self._expiry())
+            await self._store_result(job["_id"], cached, job["expires_at"])
+            await get_database()[COLLECTION].insert_one(job)
+            self.succeeded += 1
+            if reservation is not None:
+                reservation.consume()
+            return job
+
+        await get_database()[COLLECTION].insert_one(job)
+        self._finished[job["_id"]] = asyncio.Event()
+        self._queued_by_user[user_id] = self._queued_by_user.get(user_id, 0) + 1
+        self._tasks[job["_id"]] = asyncio.create_task(self._run(job, reservation, landmarks_key, fn, *args))
+        return job
+
+    async def _render(self, fn, *args):
+        """Run in the pool, waiting out 503s from a saturated pool until the job times out"""
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                return await makeup_pool.run(fn, *args)
+            except HTTPException as e:
+                if e.status_code != 503 or time.monotonic() + makeup_pool.retry_after > deadline:
+                    raise
+            await asyncio.sleep(makeup_pool.retry_after)
+
+    async def _run(self, job: dict, reservation, landmarks_key, fn, *args):
+        jobs = get_database()[COLLECTION]
+        update = {}
+        try:
+            await jobs.update_one({"_id": job["_id"]}, {"$set": {"status": "running", "started_at": datetime.utcnow()}})
+            result = await self._render(fn, *args)
+            if result is None:
+                update = {"status": "failed", "error": "Failed to process image"}
+            else:
+                result_bytes, timings, landmarks = result
+                if landmarks_key is not None:
+                    landmark_cache.put(landmarks_key, landmarks)
+                await result_cache.put(job["key"], job["format"], result_bytes)
+                expires_at = self._expiry()
+                await self._store_result(job["_id"], result_bytes, expires_at)
+                update = {"status": "done", "timings": timings, "expires_at": expires_at}
+        except asyncio.CancelledError:
+            update = {"status": "failed", "error": "Try-on job was interrupted"}
+            raise
+        except HTTPException as e:
+            update = {"status": "failed", "error": e.detail}
+        except Exception as e:
+            logger.exception("Try-on job %s failed", job["_id"])
+            update = {"status": "failed", "error": str(e)}
+        finally:
+            update.setdefault("status", "failed")
+            # A done job expires together with its stored result
+            update.setdefault("expires_at", self._expiry())
+            update["finished_at"] = datetime.utcnow()
+            try:
+                await jobs.update_one({"_id": job["_id"]}, {"$set": update})
+            except Exception:
+                logger.exception("Failed to store try-on job %s", job["_id"])
+                if update["status"] == "done":
+                    # Don't count a result the client cannot see
+                    update.update(status="failed", error="Failed to store the try-on result")
+                    try:
+                        await jobs.update_one({"_id": job["_id"]}, {"$set": update})
+                    except Exception:
+                        logger.exception("Failed to mark try-on job %s as failed", job["_id"])
+            if update["status"] == "done":
+                self.succeeded += 1
+                if reservation is not None:
+                    reservation.consume()
+            else:
+                self.failed += 1
+                if reservation is not None:
+                    reservation.release()
+            self._tasks.pop(job["_id"], None)
+            remaining = self._queued_by_user.pop(job["user_id"], 1) - 1
+            if remaining > 0:
+                self._queued_by_user[job["user_id"]] = remaining
+            self._finished.pop(job["_id"]).set()
+
+    def _abandoned(self, job: dict) -> bool:
+        """Whether an unfinished job is past any time its render could still finish in.
+
+        Covers jobs whose API worker died, or whose final update never
+        reached Mongo, before they were marked finished.
+        """
+        if job["status"] in ("done", "failed") or job["_id"] in self._tasks:
+            return False
+        give_up_at = job["created_at"] + timedelta(seconds=self.timeout + makeup_pool.queue_timeout)
+        return give_up_at < datetime.utcnow()
+
+    async def get(self, job_id: str, wait: float = 0):
+        """The job document, or None if unknown or expired.
+
+        With ``wait`` an unfinished job is long-polled for up to that many
+        seconds: local jobs are awaited directly, jobs rendered by another
+        API worker are re-read from Mongo. Jobs that can no longer finish
+        are reported as failed.
+        """
+        jobs = get_database()[COLLECTION]
+        deadline = time.monotonic() + min(wait, MAKEUP_JOB_MAX_WAIT)
+        while True:
+            job = await jobs.find_one({"_id": job_id})
+            if job is None or job["expires_at"] < datetime.utcnow():
+                return None
+            if self._abandoned(job):
+                job.update(status="failed", error="Try-on job was interrupted")
+            remaining = deadline - time.monotonic()
+            if job["status"] in ("done", "failed") or remaining <= 0:
+                return job
+            finished = self._finished.get(job_id)
+            try:
+                if finished is not None:
+                    await asyncio.wait_for(finished.wait(), remaining)
+                else:
+                    await asyncio.sleep(min(_POLL_INTERVAL, remaining))
+            except asyncio.TimeoutError:
+                pass
+
+    async def read_result(self, job: dict):
+        """Rendered bytes of a finished job, or None if they have expired"""
+        result = await get_database()[RESULTS_COLLECTION].find_one({"_id": job["_id"]})
+        return result["data"] if result is not None else None
+
+    def stats(self) -> dict:
+        return {
+            "running": len(self._tasks),
+            "submitted": self.submitted,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+
+
+makeup_jobs = MakeupJobs()
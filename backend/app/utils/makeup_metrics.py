@@ -0,0 +1,106 @@
+import time
+from contextlib import contextmanager
+
+# Upper bounds of the latency histogram buckets, in milliseconds
+LATENCY_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+# Upper bounds of the image size histogram buckets, in megapixels
+MEGAPIXEL_BUCKETS = [0.3, 0.5, 1, 2, 4, 8, 12, 16, 24]
+
+
+class Histogram:
+    """Fixed-bucket histogram whose snapshot can be summed across processes"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                return
+        self.counts[-1] += 1
+
+    def snapshot(self) -> dict:
+        buckets = {f"le_{bound}": count for bound, count in zip(self.buckets, self.counts)}
+        buckets["le_inf"] = self.counts[-1]
+        return {"count": self.count, "sum": round(self.sum, 3), "buckets": buckets}
+
+
+class MakeupMetrics:
+    """Instrumentation hook for VirtualMakeupProcessor.
+
+    Records per-stage durations and image sizes in histograms, plus
+    face-found/not-found and error counters. Any object with the same
+    record_* methods can be plugged into the processor instead.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.image_megapixels = Histogram(MEGAPIXEL_BUCKETS)
+        self.faces_found = 0
+        self.faces_not_found = 0
+        self.errors = {}
+
+    def record_stage(self, stage: str, duration_ms: float):
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = Histogram(LATENCY_BUCKETS_MS)
+        histogram.observe(duration_ms)
+
+    def record_image(self, width: int, height: int):
+        self.image_megapixels.observe(width * height / 1_000_000)
+
+    def record_face(self, found: bool):
+        if found:
+            self.faces_found += 1
+        else:
+            self.faces_not_found += 1
+
+    def record_error(self, stage: str):
+        self.errors[stage] = self.errors.get(stage, 0) + 1
+
+    def snapshot(self) -> dict:
+        return {
+            "stages_ms": {stage: histogram.snapshot() for stage, histogram in self.stages.items()},
+            "image_megapixels": self.image_megapixels.snapshot(),
+            "faces_found": self.faces_found,
+            "faces_not_found": self.faces_not_found,
+            "errors": dict(self.errors),
+        }
+
+
+class NullMetrics:
+    """Instrumentation hook that records nothing"""
+
+    def record_stage(self, stage, duration_ms):
+        pass
+
+    def record_image(self, width, height):
+        pass
+
+    def record_face(self, found):
+        pass
+
+    def record_error(self, stage):
+        pass
+
+    def snapshot(self) -> dict:
+        return {}
+
+
+@contextmanager
+def timed(instrumentation, stage: str, timings: dict = None):
+    """Time a block, report it to ``instrumentation`` and add it to ``timings`` (ms)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration_ms = (time.perf_counter() - start) * 1000
+        instrumentation.record_stage(stage, duration_ms)
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + duration_ms
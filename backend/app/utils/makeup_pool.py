@@ -0,0 +1,136 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from fastapi import HTTPException, status
+from app.utils import makeup_tasks
+
+# Rendering pool configuration
+MAKEUP_POOL_SIZE = int(os.getenv("MAKEUP_POOL_SIZE", max(1, (os.cpu_count() or 2) // 2)))
+MAKEUP_QUEUE_DEPTH = int(os.getenv("MAKEUP_QUEUE_DEPTH", 8))
+MAKEUP_QUEUE_TIMEOUT = float(os.getenv("MAKEUP_QUEUE_TIMEOUT", 30))  # seconds
+MAKEUP_RETRY_AFTER = int(os.getenv("MAKEUP_RETRY_AFTER", 5))  # seconds
+
+
+def create_executor(max_workers: int) -> ProcessPoolExecutor:
+    """Process pool whose workers each hold a warm VirtualMakeupProcessor (see makeup_tasks.init_worker)"""
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        # FaceMesh is not fork-safe, always start clean interpreters
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=makeup_tasks.init_worker,
+    )
+
+
+def merge_counters(snapshots) -> dict:
+    """Sum nested numeric counters reported by several worker processes."""
+    merged = {}
+    for snapshot in snapshots:
+        for key, value in snapshot.items():
+            if isinstance(value, dict):
+                merged[key] = merge_counters([merged.get(key, {}), value])
+            elif isinstance(value, (int, float)):
+                merged[key] = merged.get(key, 0) + value
+    return merged
+
+
+class MakeupPool:
+    """Process pool that renders virtual makeup off the event loop.
+
+    Each worker process keeps its own warm VirtualMakeupProcessor (and
+    therefore its own FaceMesh graph). At most ``size + queue_depth`` jobs
+    are accepted at once; anything beyond that is rejected immediately with
+    a 503 so the API keeps serving catalog and cart traffic during spikes.
+    """
+
+    def __init__(self, size: int, queue_depth: int, queue_timeout: float, retry_after: int):
+        self.size = size
+        self.queue_depth = queue_depth
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self._executor = None
+        self._pending = 0
+        self._completed = 0
+        self._rejected = 0
+        self._timed_out = 0
+        self._worker_stats = {}  # pid -> latest counters reported by that worker
+
+    @property
+    def capacity(self) -> int:
+        return self.size + self.queue_depth
+
+    def start(self):
+        if self._executor is not None:
+            return
+        self._executor = create_executor(self.size)
+        # Spawn every worker now so the first try-on does not pay for model loading
+        for _ in range(self.size):
+            self._executor.submit(makeup_tasks.run_task, makeup_tasks.warm_up)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            self._worker_stats.clear()
+
+    def _busy(self, detail: str) -> HTTPException:
+        return HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=detail,
+            headers={"Retry-After": str(self.retry_after)}
+        )
+
+    def _release(self, _future=None):
+        self._pending -= 1
+
+    async def run(self, fn, *args):
+        """Run ``fn(*args)`` in a worker process and return its result."""
+        if self._pending >= self.capacity:
+            self._rejected += 1
+            raise self._busy("Virtual makeup is busy right now. Please try again shortly.")
+
+        self.start()
+        loop = asyncio.get_running_loop()
+        try:
+            future = self._executor.submit(makeup_tasks.run_task, fn, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. native crash); rebuild the pool for the next request
+            self._executor = None
+            raise self._busy("Virtual makeup is restarting. Please try again shortly.")
+
+        # The slot is held until the worker is actually done, even if we stop waiting
+        self._pending += 1
+        future.add_done_callback(lambda f: loop.call_soon_threadsafe(self._release, f))
+        try:
+            pid, result, worker_stats = await asyncio.wait_for(asyncio.wrap_future(future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            future.cancel()
+            self._timed_out += 1
+            raise self._busy("Virtual makeup timed out. Please try again shortly.")
+        except BrokenProcessPool:
+            self._executor = None
+            raise self._busy("Virtual makeup is restarting. Please try again shortly.")
+        self._completed += 1
+        self._worker_stats[pid] = worker_stats
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.size,
+            "queue_depth": self.queue_depth,
+            "queue_timeout": self.queue_timeout,
+            "pending": self._pending,
+            "completed": self._completed,
+            "rejected": self._rejected,
+            "timed_out": self._timed_out,
+            **merge_counters(self._worker_stats.values()),
+        }
+
+
+makeup_pool = MakeupPool(
+    size=MAKEUP_POOL_SIZE,
+    queue_depth=MAKEUP_QUEUE_DEPTH,
+    queue_timeout=MAKEUP_QUEUE_TIMEOUT,
+    retry_after=MAKEUP_RETRY_AFTER,
+)
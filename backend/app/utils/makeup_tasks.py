@@ -0,0 +1,392 @@
+"""Functions executed inside the virtual makeup worker processes.
+
+Everything here runs in a pool worker (see app.utils.makeup_pool), so it is
+free to do blocking CPU work. Arguments and return values must be picklable.
+"""
+import math
+import os
+
+# Faces made up per image (group photos); all are found in one FaceMesh call
+MAKEUP_MAX_FACES = int(os.getenv("MAKEUP_MAX_FACES", 4))
+# Longest side of each tile in a batch sprite
+MAKEUP_BATCH_TILE_SIZE = int(os.getenv("MAKEUP_BATCH_TILE_SIZE", 640))
+
+# Warm processor owned by this worker process, created by init_worker
+_processor = None
+
+
+def init_worker():
+    global _processor
+    from app.utils.image_ingest import MAKEUP_DETECTION_MAX_SIDE
+    from app.utils.makeup_metrics import MakeupMetrics
+    from app.utils.virtual_makeup import VirtualMakeupProcessor
+    # Landmarks of known uploads are cached by the API process (see
+    # app.utils.landmark_cache) and passed in with the task
+    _processor = VirtualMakeupProcessor(
+        detection_max_side=MAKEUP_DETECTION_MAX_SIDE,
+        instrumentation=MakeupMetrics(),
+        max_num_faces=MAKEUP_MAX_FACES,
+    )
+
+
+def warm_up():
+    return None
+
+
+def worker_stats() -> dict:
+    """Counters of this worker process, merged by MakeupPool.stats()."""
+    return {
+        "metrics": _processor.instrumentation.snapshot(),
+    }
+
+
+def run_task(fn, *args):
+    """Run a task and report this worker's counters alongside its result."""
+    result = fn(*args)
+    return os.getpid(), result, worker_stats()
+
+
+def output_side(max_dimension: int = 0, preset: str = "standard") -> int:
+    """Longest output side: the smallest of the server cap, the preset's and the client's request (0 = no cap)"""
+    from app.utils.image_ingest import MAKEUP_MAX_OUTPUT_SIDE
+    from app.utils.render_presets import RENDER_PRESETS
+    sides = [side for side in (MAKEUP_MAX_OUTPUT_SIDE, RENDER_PRESETS[preset]["max_side"], max_dimension) if side]
+    return min(sides) if sides else 0
+
+
+def use_preset(preset: str) -> dict:
+    """Configure this worker's processor for a render preset and return its settings"""
+    from app.utils.render_presets import RENDER_PRESETS
+    settings = RENDER_PRESETS[preset]
+    _processor.use_preset(settings)
+    return settings
+
+
+def find_landmarks(image, known=None):
+    """Landmarks of a decoded upload: ``known`` ones cached by the API process, or detected now.
+
+    Returns (landmarks or None if there is no face, landmarks for the API
+    process to cache); like LandmarkCache, an empty array means no face.
+    """
+    import numpy as np
+
+    if known is not None:
+        # Counted like a detection, so the metrics don't depend on cache hits
+        h, w = image.shape[:2]
+        _processor.instrumentation.record_image(w, h)
+        _processor.instrumentation.record_face(len(known) > 0)
+        return (known if len(known) else None), known
+    landmarks = _processor.get_landmarks(image)
+    if landmarks is None:
+        return None, np.empty((0, 0, 2), dtype=np.int32)
+    return landmarks, landmarks
+
+
+def render_makeup(contents: bytes, lips_color, lips_intensity, cheeks_color, cheeks_intensity,
+                  output_format: str = "jpeg", quality: int = None, max_dimension: int = 0,
+                  preset: str = "standard", landmarks=None):
+    """Decode an uploaded image, apply makeup and encode the result.
+
+    ``landmarks`` are the cached ones of this upload at this size and
+    preset, if any (see find_landmarks). Returns (image_bytes, timings,
+    landmarks) where timings maps each stage to its duration in
+    milliseconds, or None if the upload is not a readable image.
+    """
+    from app.utils.image_ingest import decode_image
+    from app.utils.image_encode import encode_image
+
+    settings = use_preset(preset)
+    _processor.reset_timings()
+    try:
+        with _processor.timed("decode"):
+            image = decode_image(contents, output_side(max_dimension, preset))
+    except (OSError, ValueError):
+        _processor.instrumentation.record_error("decode")
+        return None
+
+    landmarks, found = find_landmarks(image, landmarks)
+    if landmarks is not None:
+        _processor.apply_makeup_to_landmarks(
+            image, landmarks,
+            _processor.parse_color_to_bgr(lips_color), lips_intensity,
+            _processor.parse_color_to_bgr(cheeks_color), cheeks_intensity,
+        )
+
+    with _processor.timed("encode"):
+        result_bytes = encode_image(image, output_format, quality or settings["quality"])
+    return result_bytes, dict(_processor.timings), found
+
+
+def render_makeup_batch(contents: bytes, variants: list, output_format: str = "jpeg", quality: int = None,
+                        preset: str = "standard", landmarks=None):
+    """Render several shade variants of one upload into a single sprite image.
+
+    ``variants`` is a list of (lips_color, lips_intensity, cheeks_color,
+    cheeks_intensity) tuples. The image is decoded, downscaled to the tile
+    size and run through FaceMesh once; each variant is then rendered
+    directly into its own cell of the sprite, which is encoded as
+    ``output_format``. ``landmarks`` are the cached ones of this upload at
+    the tile size, if any. Returns (image_bytes, manifest, landmarks), or
+    None if the upload is not a readable image.
+    """
+    import numpy as np
+    from app.utils.image_ingest import decode_image
+    from app.utils.image_encode import encode_image
+
+    settings = use_preset(preset)
+    _processor.reset_timings()
+    try:
+        with _processor.timed("decode"):
+            base = decode_image(contents, output_side(MAKEUP_BATCH_TILE_SIZE, preset))
+    except (OSError, ValueError):
+        _processor.instrumentation.record_error("decode")
+        return None
+    landmarks, found = find_landmarks(base, landmarks)
+
+    h, w = base.shape[:2]
+    columns = math.ceil(math.sqrt(len(variants)))
+    rows = math.ceil(len(variants) / columns)
+    sprite = np.zeros((rows * h, columns * w, 3), dtype=np.uint8)
+
+    manifest = []
+    for index, (lips_color, lips_intensity, cheeks_color, cheeks_intensity) in enumerate(variants):
+        x = (index % columns) * w
+        y = (index // columns) * h
+        tile = sprite[y:y + h, x:x + w]
+        tile[...] = base
+        if landmarks is not None:
+            _processor.apply_makeup_to_landmarks(
+                tile, landmarks,
+                _processor.parse_color_to_bgr(lips_color), lips_intensity,
+                _processor.parse_color_to_bgr(cheeks_color), cheeks_intensity,
+            )
+        manifest.append({"index": index, "x": x, "y": y, "width": w, "height": h})
+
+    with _processor.timed("encode"):
+        sprite_bytes = encode_image(sprite, output_format, quality or settings["quality"])
+    faces = len(landmarks) if landmarks is not None else 0
+    return sprite_bytes, {"face_found": faces > 0, "faces": faces, "tiles": manifest}, found
+
+
+def detect_regions(contents: bytes, max_dimension: int = 0, include_mask: bool = False, preset: str = "standard",
+                   landmarks=None):
+    """Detect faces and describe the makeup regions, without rendering.
+
+    Returns (regions, timings, landmarks), or None if the upload is not a
+    readable image. ``regions`` holds the size the coordinates refer to, the face
+    count and VirtualMakeupProcessor.describe_layers(); with
+    ``include_mask`` it also carries the blurred alpha masks of the face
+    area as a PNG (one color channel per layer, see ``mask.channels``).
+    """
+    import base64
+    import cv2
+    import numpy as np
+    from app.utils.image_ingest import decode_image
+
+    use_preset(preset)
+    _processor.reset_timings()
+    try:
+        with _processor.timed("decode"):
+            image = decode_image(contents, output_side(max_dimension, preset))
+    except (OSError, ValueError):
+        _processor.instrumentation.record_error("decode")
+        return None
+
+    landmarks, found = find_landmarks(image, landmarks)
+    h, w = image.shape[:2]
+    regions = {
+        "width": w,
+        "height": h,
+        "faces": len(landmarks) if landmarks is not None else 0,
+        "layers": _processor.describe_layers(image.shape, landmarks),
+    }
+
+    if include_mask and landmarks is not None:
+        masks, box = _processor.build_alpha_masks(image.shape, landmarks)
+        if masks is not None:
+            y0, y1, x0, x1 = box
+            # PNG holds 1, 3 or 4 channels; layers go to R, G, B in paint order
+            png = np.zeros((*masks.shape[:2], 3), dtype=np.uint8)
+            channels = ["red", "green", "blue"]
+            for index in range(min(masks.shape[2], 3)):
+                png[..., 2 - index] = masks[..., index]
+            with _processor.timed("encode"):
+                ok, encoded = cv2.imencode(".png", png)
+            if ok:
+                regions["mask"] = {
+                    "x": x0,
+                    "y": y0,
+                    "width": x1 - x0,
+                    "height": y1 - y0,
+                    "channels": {
+                        makeup_type: channels[index]
+                        for index, (makeup_type, _) in enumerate(_processor.MAKEUP_LAYERS[:3])
+                    },
+                    "png": base64.b64encode(encoded.tobytes()).decode("ascii"),
+                }
+    return regions, dict(_processor.timings), found
+
+
+def create_selfie_session(contents: bytes, directory: str, session_id: str, max_dimension: int = 0,
+                          preset: str = "standard"):
+    """Decode an upload and detect its faces once, saving both for render_selfie_session.
+
+    The image is stored as raw BGR, so it is capped at SELFIE_SESSION_MAX_SIDE
+    on top of the usual output size; decoding straight to that size lets
+    JPEGs be scaled down by libjpeg without a full-size copy. Returns
+    (meta, timings), or None if the upload is not a readable image.
+    """
+    import numpy as np
+    from app.utils.image_ingest import decode_image
+    from app.utils.selfie_sessions import session_paths, SELFIE_SESSION_MAX_SIDE
+
+    use_preset(preset)
+    _processor.reset_timings()
+    max_side = output_side(max_dimension, preset)
+    if SELFIE_SESSION_MAX_SIDE:
+        max_side = min(max_side, SELFIE_SESSION_MAX_SIDE) if max_side else SELFIE_SESSION_MAX_SIDE
+    try:
+        with _processor.timed("decode"):
+            image = decode_image(contents, max_side)
+    except (OSError, ValueError):
+        _processor.instrumentation.record_error("decode")
+        return None
+    landmarks = _processor.get_landmarks(image)
+
+    paths = session_paths(directory, session_id)
+    os.makedirs(directory, exist_ok=True)
+    np.save(paths["image"], image)
+    if landmarks is not None:
+        np.save(paths["landmarks"], landmarks)
+    h, w = image.shape[:2]
+    meta = {
+        "width": w,
+        "height": h,
+        "faces": len(landmarks) if landmarks is not None else 0,
+        "preset": preset,
+        "bytes": image.nbytes + (landmarks.nbytes if landmarks is not None else 0),
+    }
+    return meta, dict(_processor.timings)
+
+
+def render_selfie_session(directory: str, session_id: str, lips_color, lips_intensity, cheeks_color, cheeks_intensity,
+                          output_format: str = "jpeg", quality: int = None, preset: str = "standard"):
+    """Render a shade on a saved selfie session: no upload, decode or detection.
+
+    Returns (image_bytes, timings), or None if the session files are gone.
+    """
+    import numpy as np
+    from app.utils.image_encode import encode_image
+    from app.utils.selfie_sessions import session_paths
+
+    settings = use_preset(preset)
+    _processor.reset_timings()
+    paths = session_paths(directory, session_id)
+    try:
+        with _processor.timed("load"):
+            # Memory-mapped, so only one copy is made: the buffer we draw into
+            image = np.array(np.load(paths["image"], mmap_mode="r"))
+            landmarks = np.load(paths["landmarks"]) if os.path.exists(paths["landmarks"]) else None
+    except (OSError, ValueError):
+        _processor.instrumentation.record_error("load")
+        return None
+
+    if landmarks is not None:
+        _processor.apply_makeup_to_landmarks(
+            image, landmarks,
+            _processor.parse_color_to_bgr(lips_color), lips_intensity,
+            _processor.parse_color_to_bgr(cheeks_color), cheeks_intensity,
+        )
+
+    with _processor.timed("encode"):
+        result_bytes = encode_image(image, output_format, quality or settings["quality"])
+    return result_bytes, dict(_processor.timings)
+
+
+def detect_model(path: str, preset: str = "standard"):
+    """Landmarks of a catalog model photo at its render size, or None if no face is found"""
+    from app.utils.image_ingest import decode_image
+
+    use_preset(preset)
+    with open(path, "rb") as f:
+        image = decode_image(f.read(), output_side(0, preset))
+    return _processor.get_landmarks(image)
+
+
+def render_swatches(path: str, landmarks, shades: list, output_dir: str, output_format: str = "jpeg",
+                    quality: int = None, preset: str = "standard"):
+    """Render shades on a catalog model photo with landmarks detected beforehand by detect_model.
+
+    ``shades`` is a list of (file name, makeup type, BGR color, intensity);
+    each result is written to ``output_dir`` under its file name, through a
+    temporary file so an interrupted run never leaves a partial image.
+    Returns the file names written.
+    """
+    from app.utils.files import atomic_write
+    from app.utils.image_ingest import decode_image
+    from app.utils.image_encode import encode_image
+
+    settings = use_preset(preset)
+    with open(path, "rb") as f:
+        base = decode_image(f.read(), output_side(0, preset))
+
+    written = []
+    image = base.copy()
+    for name, makeup_type, color, intensity in shades:
+        image[...] = base
+        colors = {"lips": (None, 0), "cheeks": (None, 0)}
+        colors[makeup_type] = (color, intensity)
+        _processor.apply_makeup_to_landmarks(image, landmarks, *colors["lips"], *colors["cheeks"])
+
+        atomic_write(os.path.join(output_dir, name), encode_image(image, output_format, quality or settings["quality"]))
+        written.append(name)
+    return written
+
+
+def estimate_skin_tone(contents: bytes, preset: str = "standard"):
+    """Detect the face in an upload and estimate its skin tone.
+
+    Returns ((L, a, b) or None if no face was found, timings), or None if
+    the upload is not a readable image.
+    """
+    from app.utils.image_ingest import decode_image
+
+    use_preset(preset)
+    _processor.reset_timings()
+    try:
+        with _processor.timed("decode"):
+            image = decode_image(contents, output_side(0, preset))
+    except (OSError, ValueError):
+        _processor.instrumentation.record_error("decode")
+        return None
+
+    landmarks = _processor.get_landmarks(image)
+    if landmarks is None:
+        return None, dict(_processor.timings)
+    with _processor.timed("skin_tone"):
+        skin = _processor.estimate_skin_tone(image, landmarks)
+    return skin, dict(_processor.timings)
+
+
+def estimate_session_skin_tone(directory: str, session_id: str):
+    """Skin tone of a saved selfie session, from its stored image and landmarks.
+
+    Returns ((L, a, b) or None if it has no face, timings), or None if the
+    session files are gone.
+    """
+    import numpy as np
+    from app.utils.selfie_sessions import session_paths
+
+    _processor.reset_timings()
+    paths = session_paths(directory, session_id)
+    try:
+        with _processor.timed("load"):
+            image = np.load(paths["image"], mmap_mode="r")
+            landmarks = np.load(paths["landmarks"]) if os.path.exists(paths["landmarks"]) else None
+    except (OSError, ValueError):
+        return None
+    if landmarks is None:
+        return None, dict(_processor.timings)
+    with _processor.timed("skin_tone"):
+        skin = _processor.estimate_skin_tone(image, landmarks)
+    return skin, dict(_processor.timings)
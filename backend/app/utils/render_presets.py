@@ -0,0 +1,58 @@
+import os
+from app.utils.image_encode import MAKEUP_OUTPUT_QUALITY
+from app.utils.image_ingest import MAKEUP_DETECTION_MAX_SIDE, MAKEUP_MAX_OUTPUT_SIDE
+
+# Named quality/speed tradeoffs of the try-on renderer:
+#   refine_landmarks    FaceMesh iris/lip refinement (slower, tighter lip outline)
+#   detection_max_side  longest side FaceMesh runs on
+#   max_side            longest side of the rendered result (0 = uploaded size)
+#   blur                blur kernel per makeup type, as a fraction of the short side
+#   quality             default encoder quality
+# "standard" is what every render used before presets existed.
+RENDER_PRESETS = {
+    "preview": {
+        "refine_landmarks": False,
+        "detection_max_side": 320,
+        "max_side": 512,
+        "blur": {"lips": 0.006, "cheeks": 0.02},
+        "quality": 60,
+    },
+    "standard": {
+        "refine_landmarks": True,
+        "detection_max_side": MAKEUP_DETECTION_MAX_SIDE,
+        "max_side": MAKEUP_MAX_OUTPUT_SIDE,
+        "blur": {"lips": 0.008, "cheeks": 0.025},
+        "quality": MAKEUP_OUTPUT_QUALITY,
+    },
+    "hq": {
+        "refine_landmarks": True,
+        "detection_max_side": 1280,
+        "max_side": 0,
+        "blur": {"lips": 0.008, "cheeks": 0.025},
+        "quality": 92,
+    },
+}
+
+# Cheapest first; a tier may use its own preset and anything cheaper
+PRESET_ORDER = ["preview", "standard", "hq"]
+
+# Preset used when a request does not name one
+MAKEUP_DEFAULT_PRESET = os.getenv("MAKEUP_DEFAULT_PRESET", "standard")
+
+# Best preset each membership tier may render with
+membership_presets = {
+    "free": "standard",
+    "gold": "hq",
+    "diamond": "hq",
+}
+
+
+def resolve_preset(requested, user) -> str:
+    """The preset a request renders with: the requested one (or the default), capped by the user's tier"""
+    name = requested if requested in RENDER_PRESETS else MAKEUP_DEFAULT_PRESET
+    if user.role == "admin":
+        return name
+    best = membership_presets.get(user.membership, "standard")
+    if PRESET_ORDER.index(name) > PRESET_ORDER.index(best):
+        return best
+    return name
@@ -0,0 +1,204 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from app.utils.files import atomic_write
+
+logger = logging.getLogger(__name__)
+
+# Rendered try-on results cache: a small in-memory tier in front of a larger on-disk tier
+TRYON_CACHE_MEMORY_BYTES = int(os.getenv("TRYON_CACHE_MEMORY_MB", 64)) * 1024 * 1024
+TRYON_CACHE_DISK_BYTES = int(os.getenv("TRYON_CACHE_DISK_MB", 512)) * 1024 * 1024
+TRYON_CACHE_DIR = os.getenv("TRYON_CACHE_DIR", "app/static/tryon_cache")
+# Seconds between re-reads of the disk tier, which picks up files written and removed by other API workers
+TRYON_CACHE_RESCAN_INTERVAL = float(os.getenv("TRYON_CACHE_RESCAN_INTERVAL", 60))
+
+
+def result_key(contents: bytes, params: dict, output_format: str) -> str:
+    """Cache key of a render: hash of the uploaded bytes, the normalized parameters and the format"""
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(hashlib.blake2b(contents, digest_size=20).digest())
+    digest.update(json.dumps(params, sort_keys=True, separators=(",", ":")).encode())
+    digest.update(output_format.encode())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Two-tier LRU cache of rendered try-on images.
+
+    Entries are keyed by result_key(), which also serves as the ETag. The
+    memory tier holds the most recently used results; every result is also
+    written to ``directory`` (one file per key, sharded by the first two hex
+    digits) and indexed again on startup, so it survives restarts. Both tiers
+    evict the least recently used entries once over their byte budget. Disk
+    reads and writes run in a thread.
+
+    The directory is shared by the API workers of a host, each with its own
+    index. Every ``rescan_interval`` seconds the index is rebuilt from the
+    directory itself, file mtimes giving the recency, so the disk budget
+    holds for all workers together (give or take what they wrote since) and
+    entries another worker evicted are forgotten.
+    """
+
+    def __init__(self, directory: str = TRYON_CACHE_DIR,
+                 max_memory_bytes: int = TRYON_CACHE_MEMORY_BYTES,
+                 max_disk_bytes: int = TRYON_CACHE_DISK_BYTES,
+                 rescan_interval: float = TRYON_CACHE_RESCAN_INTERVAL):
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.rescan_interval = rescan_interval
+        self._memory = OrderedDict()  # key -> bytes
+        self._memory_bytes = 0
+        self._disk = OrderedDict()  # key -> (path, size)
+        self._disk_bytes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._rescanner = None
+
+    def _path(self, key: str, output_format: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.{output_format}")
+
+    def _scan(self) -> list:
+        """Files in the directory as (mtime, key, path, size), least recently used first"""
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                key, ext = os.path.splitext(name)
+                if ext == ".tmp":
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, key, path, stat.st_size))
+        return sorted(entries)
+
+    def _index(self, entries: list):
+        self._disk.clear()
+        self._disk_bytes = 0
+        for _, key, path, size in entries:
+            self._disk[key] = (path, size)
+            self._disk_bytes += size
+        self._evict_disk()
+
+    def load(self):
+        """Index the files already on disk, least recently used first"""
+        os.makedirs(self.directory, exist_ok=True)
+        self._index(self._scan())
+
+    async def start(self):
+        """Index the directory and keep re-reading it, see the class docstring"""
+        await asyncio.to_thread(self.load)
+        if self._rescanner is None:
+            self._rescanner = asyncio.create_task(self._rescan_periodically())
+
+    def stop(self):
+        if self._rescanner is not None:
+            self._rescanner.cancel()
+            self._rescanner = None
+
+    async def _rescan_periodically(self):
+        while True:
+            await asyncio.sleep(self.rescan_interval)
+            try:
+                self._index(await asyncio.to_thread(self._scan))
+            except Exception:
+                logger.exception("Failed to rescan the try-on result cache")
+
+    def _remember(self, key: str, data: bytes):
+        if len(data) > self.max_memory_bytes:
+            return
+        if key in self._memory:
+            self._memory_bytes -= len(self._memory.pop(key))
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _evict_disk(self):
+        while self._disk and self._disk_bytes > self.max_disk_bytes:
+            _, (path, size) = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    async def get(self, key: str):
+        """Cached bytes for ``key`` and the tier they came from ("memory"/"disk"), or (None, None)"""
+        data = self._memory.get(key)
+        if data is not None:
+            self._memory.move_to_end(key)
+            if key in self._disk:
+                self._disk.move_to_end(key)
+            self.memory_hits += 1
+            return data, "memory"
+
+        entry = self._disk.get(key)
+        if entry is not None:
+            path, size = entry
+            try:
+                data = await asyncio.to_thread(self._read, path)
+            except OSError:
+                # Removed behind our back (e.g. by another worker's eviction)
+                if self._disk.pop(key, None) is not None:
+                    self._disk_bytes -= size
+            else:
+                self._disk.move_to_end(key)
+                self._remember(key, data)
+                self.disk_hits += 1
+                return data, "disk"
+
+        self.misses += 1
+        return None, None
+
+    async def put(self, key: str, output_format: str, data: bytes):
+        self._remember(key, data)
+        if key in self._disk:
+            self._disk.move_to_end(key)
+            return
+        path = self._path(key, output_format)
+        try:
+            await asyncio.to_thread(self._write, path, data)
+        except OSError:
+            logger.exception("Failed to write try-on result to %s", path)
+            return
+        self._disk[key] = (path, len(data))
+        self._disk_bytes += len(data)
+        self._evict_disk()
+
+    @staticmethod
+    def _read(path: str) -> bytes:
+        with open(path, "rb") as f:
+            data = f.read()
+        # The file's mtime is its recency when the index is rebuilt on startup
+        os.utime(path)
+        return data
+
+    @staticmethod
+    def _write(path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        atomic_write(path, data)
+
+    def stats(self) -> dict:
+        return {
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+            "disk_entries": len(self._disk),
+            "disk_bytes": self._disk_bytes,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+result_cache = ResultCache()
@@ -0,0 +1,185 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from fastapi import HTTPException
+from app.utils.files import atomic_write
+
+# Selfie sessions: decoded uploads kept server-side so shade changes don't re-upload them
+SELFIE_SESSION_TTL = float(os.getenv("SELFIE_SESSION_TTL", 900))  # seconds since last use
+SELFIE_SESSIONS_PER_USER = int(os.getenv("SELFIE_SESSIONS_PER_USER", 3))
+SELFIE_SESSION_MAX_BYTES = int(os.getenv("SELFIE_SESSION_MAX_MB", 512)) * 1024 * 1024
+SELFIE_SESSION_DIR = os.getenv("SELFIE_SESSION_DIR", "app/selfie_sessions")
+# Longest side of the stored image; a 1280px selfie is ~3.5 MB as raw BGR
+SELFIE_SESSION_MAX_SIDE = int(os.getenv("SELFIE_SESSION_MAX_SIDE", 1280))
+
+
+def session_paths(directory: str, session_id: str) -> dict:
+    """Files of a session: the decoded BGR image and landmarks as .npy, and its metadata"""
+    base = os.path.join(directory, session_id)
+    return {
+        "image": f"{base}.image.npy",
+        "landmarks": f"{base}.landmarks.npy",
+        "meta": f"{base}.json",
+    }
+
+
+class SelfieSessions:
+    """Short-lived server-side copies of decoded selfies and their landmarks.
+
+    A render worker decodes the upload once (downscaled to the preset's
+    output size, and at most SELFIE_SESSION_MAX_SIDE), detects the faces and saves both as .npy files in
+    ``directory``; follow-up renders memory-map them instead of receiving
+    and decoding the image again. Sessions expire ``ttl`` seconds after
+    their last use, each user keeps at most ``per_user`` of them (the
+    oldest is dropped) and the files of all sessions stay under
+    ``max_bytes`` (the least recently used are dropped). The metadata is
+    written next to the files and is what counts: every API worker on the
+    host reads it to serve a session, and the caps are enforced over all
+    the sessions in ``directory``, whichever worker created them.
+    """
+
+    def __init__(self, directory: str = SELFIE_SESSION_DIR, ttl: float = SELFIE_SESSION_TTL,
+                 per_user: int = SELFIE_SESSIONS_PER_USER, max_bytes: int = SELFIE_SESSION_MAX_BYTES):
+        self.directory = directory
+        self.ttl = ttl
+        self.per_user = per_user
+        self.max_bytes = max_bytes
+        self._sessions = {}  # session id -> metadata, oldest first
+        self.created = 0
+        self.hits = 0
+        self.expired = 0
+
+    def start(self):
+        """Remove the sessions left behind by a previous run that have expired since"""
+        os.makedirs(self.directory, exist_ok=True)
+        now = time.time()
+        names = os.listdir(self.directory)
+        with_meta = {name[:-len(".json")] for name in names if name.endswith(".json")}
+        live = {meta["session_id"] for meta in self._stored() if meta["expires_at"] >= now}
+        stale_before = now - self.ttl
+        for name in names:
+            session_id = name.split(".", 1)[0]
+            if session_id in live:
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                # Files without metadata may be a session a worker is creating right now
+                if session_id in with_meta or os.stat(path).st_mtime < stale_before:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def new_id(self) -> str:
+        return uuid.uuid4().hex
+
+    def paths(self, session_id: str) -> dict:
+        return session_paths(self.directory, session_id)
+
+    def _bytes(self) -> int:
+        return sum(meta["bytes"] for meta in self._sessions.values())
+
+    async def add(self, session_id: str, user_id: str, meta: dict) -> dict:
+        """Register a session whose files a worker just wrote, evicting to stay within the caps"""
+        now = time.time()
+        meta = {**meta, "session_id": session_id, "user_id": user_id, "created_at": now, "expires_at": now + self.ttl}
+        await asyncio.to_thread(self._write_meta, session_id, meta)
+        self._sessions[session_id] = meta
+        self.created += 1
+
+        for key in await asyncio.to_thread(self._over_caps, session_id, user_id):
+            await self.remove(key)
+        return meta
+
+    def _over_caps(self, session_id: str, user_id: str) -> list:
+        """Ids of the stored sessions to drop after ``session_id`` was added: expired ones, then over the caps"""
+        now = time.time()
+        stored = self._stored()
+        drop = [meta["session_id"] for meta in stored if meta["expires_at"] < now and meta["session_id"] != session_id]
+        live = [meta for meta in stored if meta["session_id"] not in drop]
+
+        owned = sorted((meta for meta in live if meta["user_id"] == user_id), key=lambda meta: meta.get("created_at", 0))
+        drop += [meta["session_id"] for meta in owned[:max(0, len(owned) - self.per_user)] if meta["session_id"] != session_id]
+
+        total = sum(meta["bytes"] for meta in live if meta["session_id"] not in drop)
+        for meta in sorted(live, key=lambda meta: meta["expires_at"]):
+            if total <= self.max_bytes:
+                break
+            if meta["session_id"] != session_id and meta["session_id"] not in drop:
+                drop.append(meta["session_id"])
+                total -= meta["bytes"]
+        return drop
+
+    async def get(self, session_id: str, user) -> dict:
+        """Metadata of a live session of ``user``, extending its lifetime; 404 otherwise"""
+        await self.sweep()
+        meta = None
+        if all(c in "0123456789abcdef" for c in session_id):
+            # The stored metadata is current even if another API worker used or dropped the session
+            meta = await asyncio.to_thread(self._read_meta, session_id)
+        if meta is None or meta["expires_at"] < time.time():
+            self._sessions.pop(session_id, None)
+            meta = None
+        if meta is None or (meta["user_id"] != str(user.id) and user.role != "admin"):
+            raise HTTPException(status_code=404, detail="Selfie session not found or expired; upload the photo again")
+        self._sessions[session_id] = meta
+        meta["expires_at"] = time.time() + self.ttl
+        # Other API workers see the extended lifetime too
+        await asyncio.to_thread(self._write_meta, session_id, meta)
+        self.hits += 1
+        return meta
+
+    async def remove(self, session_id: str):
+        self._sessions.pop(session_id, None)
+        await asyncio.to_thread(self._remove_files, session_id)
+
+    async def sweep(self):
+        now = time.time()
+        for session_id in [key for key, meta in self._sessions.items() if meta["expires_at"] < now]:
+            # The session may have been used through another API worker since
+            stored = await asyncio.to_thread(self._read_meta, session_id)
+            if stored is not None and stored["expires_at"] >= now:
+                self._sessions[session_id]["expires_at"] = stored["expires_at"]
+                continue
+            self.expired += 1
+            await self.remove(session_id)
+
+    def _write_meta(self, session_id: str, meta: dict):
+        atomic_write(self.paths(session_id)["meta"], json.dumps(meta).encode())
+
+    def _stored(self) -> list:
+        """Metadata of every session in the directory, whichever API worker created it"""
+        stored = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                meta = self._read_meta(name[:-len(".json")])
+                if meta is not None:
+                    stored.append(meta)
+        return stored
+
+    def _read_meta(self, session_id: str):
+        try:
+            with open(self.paths(session_id)["meta"]) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _remove_files(self, session_id: str):
+        for path in self.paths(session_id).values():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._sessions),
+            "bytes": self._bytes(),
+            "created": self.created,
+            "hits": self.hits,
+            "expired": self.expired,
+        }
+
+
+selfie_sessions = SelfieSessions()
@@ -0,0 +1,122 @@
+import asyncio
+from app.utils.shade_registry import parse_color, try_on_makeup_type, TRY_ON_PRODUCT_FILTER
+
+# Where a flattering shade sits relative to the skin tone, in CIELAB (dL, da, db):
+# lips a good deal deeper and redder than the skin, blush slightly deeper and rosier
+SHADE_TARGET_OFFSETS = {
+    "lips": (-22.0, 28.0, 4.0),
+    "cheeks": (-8.0, 16.0, 0.0),
+}
+
+
+def bgr_to_lab(colors):
+    """CIELAB (L in 0-100) of an (N, 3) array of BGR colors, all converted at once"""
+    import cv2
+    import numpy as np
+
+    pixels = np.asarray(colors, dtype=np.float32).reshape(1, -1, 3) / 255.0
+    return cv2.cvtColor(pixels, cv2.COLOR_BGR2Lab).reshape(-1, 3)
+
+
+class ShadeIndex:
+    """CIELAB matrix of every product color, for nearest-shade lookups.
+
+    Built from the ``colors`` of the TRY_ON_PRODUCT_FILTER products in the
+    TRY_ON_CATEGORIES.
+    refresh() only reloads the products whenever they change; the matrices
+    are built in a thread on the next recommendation, so neither startup
+    nor product writes import OpenCV and NumPy on the event loop. Each
+    makeup type keeps its own (N, 3) float32 matrix, so a lookup is a
+    single vectorized distance computation over it.
+    """
+
+    def __init__(self):
+        self._products = []  # product documents of the last refresh()
+        self._shades = None  # makeup type -> (lab matrix, [(product id, name, color, hex)]), None until built
+
+    def _build(self, products) -> dict:
+        import numpy as np
+
+        entries = {makeup_type: [] for makeup_type in SHADE_TARGET_OFFSETS}
+        for product in products:
+            makeup_type = try_on_makeup_type(product)
+            if makeup_type is None:
+                continue
+            for color in product.get("colors") or []:
+                if isinstance(color, str) and color.strip():
+                    b, g, r = parse_color(color)
+                    entries[makeup_type].append((str(product["_id"]), product.get("name"), color, (b, g, r)))
+
+        shades = {}
+        for makeup_type, items in entries.items():
+            if items:
+                lab = bgr_to_lab([bgr for *_, bgr in items])
+            else:
+                lab = np.empty((0, 3), dtype=np.float32)
+            shades[makeup_type] = (lab, [
+                (product_id, name, color, f"#{r:02X}{g:02X}{b:02X}")
+                for product_id, name, color, (b, g, r) in items
+            ])
+        return shades
+
+    async def refresh(self):
+        """Reload the current product catalog; the index is rebuilt on the next recommendation"""
+        from app.utils.database import get_database
+        db = get_database()
+        self._products = await db.products.find(
+            TRY_ON_PRODUCT_FILTER,
+            {"name": 1, "category": 1, "colors": 1}
+        ).to_list(length=None)
+        self._shades = None
+
+    async def _built(self) -> dict:
+        shades = self._shades
+        if shades is None:
+            products = self._products
+            shades = await asyncio.to_thread(self._build, products)
+            # Products refreshed meanwhile are built on the next call
+            if self._products is products:
+                self._shades = shades
+        return shades
+
+    def nearest(self, shades: dict, makeup_type: str, target, limit: int = 5) -> list:
+        """Closest product colors to a CIELAB ``target`` by CIE76 delta E, best color per product"""
+        import numpy as np
+
+        lab, entries = shades.get(makeup_type, (None, []))
+        if not entries:
+            return []
+        distances = np.linalg.norm(lab - np.asarray(target, dtype=np.float32), axis=1)
+        results = []
+        seen = set()
+        for index in np.argsort(distances):
+            product_id, name, color, hex_value = entries[index]
+            if product_id in seen:
+                continue
+            seen.add(product_id)
+            results.append({
+                "product_id": product_id,
+                "name": name,
+                "color": color,
+                "hex": hex_value,
+                "delta_e": round(float(distances[index]), 2),
+            })
+            if len(results) >= limit:
+                break
+        return results
+
+    async def recommend(self, skin_lab, limit: int = 5) -> dict:
+        """Best matching shades of every makeup type for a CIELAB skin tone"""
+        shades = await self._built()
+        recommendations = {}
+        for makeup_type, (dl, da, db) in SHADE_TARGET_OFFSETS.items():
+            l, a, b = skin_lab
+            target = (min(100.0, max(0.0, l + dl)), a + da, b + db)
+            recommendations[makeup_type] = self.nearest(shades, makeup_type, target, limit)
+        return recommendations
+
+    def __len__(self):
+        return sum(len(entries) for _, entries in (self._shades or {}).values())
+
+
+shade_index = ShadeIndex()
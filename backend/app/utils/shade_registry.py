@@ -0,0 +1,142 @@
+import re
+
+# Named colors accepted by the virtual makeup API (case insensitive)
+NAMED_COLORS = {
+    'red': '#FF0000',
+    'pink': '#FF69B4',
+    'nude': '#E3BC9A',
+    'coral': '#FF7F50',
+    'burgundy': '#800020',
+    'light': '#FFE4E1',
+    'medium': '#DEB887',
+    'dark': '#4B0082',
+    'tan': '#D2B48C',
+    'beige': '#F5F5DC',
+    'black': '#000000',
+    'white': '#FFFFFF',
+    'blue': '#0000FF',
+    'green': '#008000',
+    'yellow': '#FFFF00',
+    'purple': '#800080',
+    'orange': '#FFA500',
+    'brown': '#A52A2A',
+    'gray': '#808080',
+    'gold': '#FFD700',
+    'silver': '#C0C0C0',
+    'rose gold': '#B76E79'
+}
+
+# Product category (lowercase) -> makeup type its colors are tried on as,
+# shared by the shade recommendations and the catalog swatch renderer
+TRY_ON_CATEGORIES = {
+    "son môi": "lips",
+    "son dưỡng": "lips",
+    "chì kẻ môi": "lips",
+    "má hồng": "cheeks",
+}
+
+# Products whose colors are offered for try-on: those the storefront lists
+TRY_ON_PRODUCT_FILTER = {"is_active": True}
+
+# A more neutral default color (light pink) for anything unparseable
+DEFAULT_BGR = (180, 105, 255)
+
+# Upper bound on remembered ad-hoc color strings sent by clients
+MAX_REMEMBERED = 4096
+
+_HEX_PATTERN = re.compile(r'^[0-9A-Fa-f]{6}$')
+
+
+def hex_to_bgr(hex_color) -> tuple:
+    """Convert hex color (#RRGGBB, RRGGBB or #RGB) to BGR"""
+    hex_color = str(hex_color).strip()
+    if hex_color.startswith('#'):
+        hex_color = hex_color[1:]
+    # Handle shorthand hex (e.g., #FFF)
+    if len(hex_color) == 3:
+        hex_color = ''.join([c * 2 for c in hex_color])
+    if not _HEX_PATTERN.match(hex_color):
+        return DEFAULT_BGR
+    r = int(hex_color[0:2], 16)
+    g = int(hex_color[2:4], 16)
+    b = int(hex_color[4:6], 16)
+    return (b, g, r)
+
+
+def try_on_makeup_type(product: dict):
+    """Makeup type a product's colors are tried on as ("lips"/"cheeks"), or None"""
+    return TRY_ON_CATEGORIES.get(str(product.get("category", "")).strip().lower())
+
+
+def parse_color(color_value) -> tuple:
+    """Convert a named, rgb(), rgba() or hex color string to BGR"""
+    try:
+        color_value = str(color_value).strip()
+        named = NAMED_COLORS.get(color_value.lower())
+        if named is not None:
+            return hex_to_bgr(named)
+
+        for prefix in ('rgba(', 'rgb('):
+            if color_value.startswith(prefix) and color_value.endswith(')'):
+                values = [float(x.strip()) for x in color_value[len(prefix):-1].split(',')]
+                if len(values) < 3:
+                    return DEFAULT_BGR
+                r, g, b = (int(min(255, max(0, v))) for v in values[:3])
+                return (b, g, r)
+
+        return hex_to_bgr(color_value)
+    except (ValueError, TypeError):
+        return DEFAULT_BGR
+
+
+class ShadeRegistry:
+    """Precomputed map from accepted color strings to BGR tuples.
+
+    Built from NAMED_COLORS plus the ``colors`` of every product, and
+    refreshed whenever products change. Lookups of known strings are a
+    single dict get; unknown strings are parsed once and remembered.
+    """
+
+    def __init__(self):
+        self._shades = {}
+        self._remembered = 0
+        self._build([])
+
+    def _build(self, product_colors):
+        shades = {}
+        for name, hex_value in NAMED_COLORS.items():
+            bgr = hex_to_bgr(hex_value)
+            shades[name] = bgr
+            shades[name.title()] = bgr
+            shades[name.upper()] = bgr
+            shades[hex_value] = bgr
+        for color in product_colors:
+            if isinstance(color, str):
+                shades[color] = parse_color(color)
+        self._shades = shades
+        self._remembered = 0
+
+    async def refresh(self):
+        """Rebuild from the current product catalog"""
+        from app.utils.database import get_database
+        db = get_database()
+        product_colors = await db.products.distinct("colors")
+        self._build(product_colors)
+
+    def lookup(self, color_value) -> tuple:
+        """BGR tuple for a color string; BGR tuples pass through unchanged"""
+        if isinstance(color_value, tuple):
+            return color_value
+        bgr = self._shades.get(color_value)
+        if bgr is None:
+            bgr = parse_color(color_value)
+            if self._remembered < MAX_REMEMBERED and isinstance(color_value, str):
+                self._shades[color_value] = bgr
+                self._remembered += 1
+        return bgr
+
+    def __len__(self):
+        return len(self._shades)
+
+
+shade_registry = ShadeRegistry()
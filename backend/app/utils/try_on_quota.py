@@ -0,0 +1,178 @@
+import asyncio
+import logging
+import os
+import time
+from fastapi import HTTPException
+from pymongo import UpdateOne
+from app.utils.database import get_database
+
+logger = logging.getLogger(__name__)
+
+# Seconds between batched flushes of try-on increments to Mongo
+TRY_ON_FLUSH_INTERVAL = float(os.getenv("TRY_ON_FLUSH_INTERVAL", 5))
+# Buckets of users idle for this long (with nothing left to flush) are dropped
+TRY_ON_BUCKET_IDLE_TTL = float(os.getenv("TRY_ON_BUCKET_IDLE_TTL", 3600))
+
+membership_limits = {
+    "free": 10,
+    "gold": 50,
+    "diamond": float('inf')
+}
+
+
+class _Bucket:
+    __slots__ = ("user_id", "used", "pending", "reserved", "membership", "last_seen")
+
+    def __init__(self, user_id, used: int, membership: str):
+        self.user_id = user_id
+        self.used = used
+        self.pending = 0
+        self.reserved = 0
+        self.membership = membership
+        self.last_seen = time.monotonic()
+
+
+class Reservation:
+    """Try-ons held for one request by TryOnQuota.check().
+
+    consume() counts them once the render succeeds; release() gives back
+    whatever was not consumed, so it can always be called when the request
+    ends. Also usable as a context manager that releases on exit.
+    """
+
+    __slots__ = ("bucket", "count")
+
+    def __init__(self, bucket, count: int):
+        self.bucket = bucket  # None for admins, who are not counted
+        self.count = count
+
+    def consume(self, count: int = None):
+        """Count ``count`` (by default all) of the held try-ons; written to Mongo on the next flush"""
+        count = self.count if count is None else min(count, self.count)
+        if self.bucket is not None and count > 0:
+            self.bucket.reserved -= count
+            self.bucket.used += count
+            self.bucket.pending += count
+        self.count -= count
+
+    def release(self):
+        if self.bucket is not None and self.count > 0:
+            self.bucket.reserved -= self.count
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class TryOnQuota:
+    """Per-user try-on counters kept in memory and written behind to Mongo.
+
+    Each user's bucket is seeded from the ``try_on_count`` of the user
+    document already loaded for authentication, so checking the quota costs
+    no extra query. check() reserves the try-ons in the bucket in the same
+    step, so concurrent requests of one user cannot all pass before any of
+    them is counted; the Reservation is then consumed when the render
+    succeeds or released when it fails. Increments are applied locally and
+    flushed periodically as one unordered ``bulk_write`` of ``$inc``
+    updates; anything still pending is flushed on shutdown.
+    """
+
+    def __init__(self, flush_interval: float = TRY_ON_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._buckets = {}
+        self._task = None
+        self.flushes = 0
+        self.flushed_increments = 0
+
+    def _bucket(self, user) -> _Bucket:
+        key = str(user.id)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(user.id, user.try_on_count, user.membership)
+        else:
+            # The stored count may include increments from other API workers
+            bucket.used = max(bucket.used, user.try_on_count + bucket.pending)
+            bucket.membership = user.membership
+            bucket.last_seen = time.monotonic()
+        return bucket
+
+    def check(self, user, count: int = 1) -> Reservation:
+        """Reserve ``count`` try-ons of the user's quota, or raise 403 if they don't fit (admins are exempt).
+
+        The check and the reservation happen without yielding to the event
+        loop, so other requests already see the held try-ons.
+        """
+        if user.role == "admin":
+            return Reservation(None, count)
+        bucket = self._bucket(user)
+        limit = membership_limits.get(bucket.membership, 10)
+        if bucket.used + bucket.reserved + count > limit:
+            raise HTTPException(status_code=403, detail=f"You have reached your try-on limit for your {user.membership} account. Please upgrade to try more.")
+        bucket.reserved += count
+        return Reservation(bucket, count)
+
+    def consume(self, user, count: int = 1):
+        """Record ``count`` successful try-ons made without a reservation; written to Mongo on the next flush"""
+        if user.role == "admin":
+            return
+        bucket = self._bucket(user)
+        bucket.used += count
+        bucket.pending += count
+
+    async def flush(self):
+        pending = [bucket for bucket in self._buckets.values() if bucket.pending]
+        if pending:
+            increments = [(bucket, bucket.pending) for bucket in pending]
+            for bucket in pending:
+                bucket.pending = 0
+            try:
+                db = get_database()
+                await db.users.bulk_write(
+                    [UpdateOne({"_id": bucket.user_id}, {"$inc": {"try_on_count": count}}) for bucket, count in increments],
+                    ordered=False
+                )
+            except Exception:
+                # Keep the increments for the next attempt
+                for bucket, count in increments:
+                    bucket.pending += count
+                raise
+            self.flushes += 1
+            self.flushed_increments += sum(count for _, count in increments)
+
+        idle_before = time.monotonic() - TRY_ON_BUCKET_IDLE_TTL
+        for key in [key for key, bucket in self._buckets.items() if not bucket.pending and not bucket.reserved and bucket.last_seen < idle_before]:
+            del self._buckets[key]
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush try-on counts")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self):
+        """Stop the periodic flush and write out everything still pending"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._buckets),
+            "pending_increments": sum(bucket.pending for bucket in self._buckets.values()),
+            "reserved": sum(bucket.reserved for bucket in self._buckets.values()),
+            "flushes": self.flushes,
+            "flushed_increments": self.flushed_increments,
+        }
+
+
+try_on_quota = TryOnQuota()
@@ -1,19 +1,73 @@
+import logging
 import cv2
 import numpy as np
 import mediapipe as mp
 from PIL import Image
-import re
+from app.utils.makeup_metrics import NullMetrics, timed
+from app.utils.shade_registry import shade_registry, hex_to_bgr
+
+logger = logging.getLogger(__name__)
 
 class VirtualMakeupProcessor:
-    def __init__(self):
-        # MediaPipe setup
+    # Region geometry, precomputed once as NumPy index arrays and templates
+    OUTER_LIP_INDICES = np.array([
+        61, 146, 91, 181, 84, 17, 314, 405, 320, 307, 375, 321, 308, 324, 318,
+        402, 317, 14, 87, 178, 88, 95, 78, 191, 80, 81, 82, 13, 312, 311, 310, 415
+    ], dtype=np.intp)
+    LEFT_CHEEK_KEY_POINTS = np.array([116, 117, 118, 50, 36, 205, 206, 207, 213, 192, 147], dtype=np.intp)
+    RIGHT_CHEEK_KEY_POINTS = np.array([345, 346, 347, 280, 266, 425, 426, 427, 436, 416, 376], dtype=np.intp)
+    # Outer eye corners; their distance is the face scale
+    EYE_OUTER_CORNERS = (33, 263)
+    # Forehead points sampled for the skin tone, together with the cheek centers
+    FOREHEAD_POINTS = np.array([151, 108, 337], dtype=np.intp)
+    # Half-size of each skin sample patch relative to the inter-ocular distance
+    SKIN_PATCH_RADIUS = 0.05
+    # Unit ellipse sampled every 20 degrees, as (cos, sin) rows
+    UNIT_ELLIPSE = np.stack([np.cos(np.radians(np.arange(0, 360, 20))), np.sin(np.radians(np.arange(0, 360, 20)))], axis=1)
+    # Cheek oval radii (horizontal, vertical) relative to the inter-ocular distance.
+    # At a 175px eye distance this is the former fixed 35x25px oval.
+    CHEEK_RADII = np.array([0.20, 0.143])
+    REFERENCE_INTEROCULAR = 175.0
+    # Blend mode and full-intensity opacity of each makeup type
+    BLEND_MODES = {
+        "lips": ("multiply", 0.7),
+        "cheeks": ("normal", 0.4),
+    }
+    # Gaussian blur kernel of each makeup type: (fraction of the short image side, minimum size)
+    BLUR_FRACTIONS = {
+        "lips": (0.008, 3),
+        "cheeks": (0.025, 15),
+    }
+    # Layers in paint order: makeup type and the regions it covers
+    MAKEUP_LAYERS = [
+        ("cheeks", ["LEFT_CHEEK", "RIGHT_CHEEK"]),
+        ("lips", ["LIPS"]),
+    ]
+
+    def __init__(self, landmark_cache=None, static_image_mode=True, detection_max_side=None, instrumentation=None,
+                 max_num_faces=1, refine_landmarks=True):
+        # Optional LandmarkCache shared by every call on this processor
+        self.landmark_cache = landmark_cache
+        # Instrumentation hook (see MakeupMetrics) receiving stage durations,
+        # image sizes, face found/not found and errors
+        self.instrumentation = instrumentation or NullMetrics()
+        # Stage durations (ms) of the current request, see reset_timings()
+        self.timings = {}
+        # FaceMesh works at low resolution internally, so larger images are
+        # downscaled to this longest side before detection
+        self.detection_max_side = detection_max_side
+        # Blur kernel fractions in use, see use_preset()
+        self.blur_fractions = dict(self.BLUR_FRACTIONS)
+
+        # MediaPipe setup. static_image_mode=False tracks the face between
+        # consecutive video frames instead of re-detecting it on every frame.
         self.mp_face_mesh = mp.solutions.face_mesh
-        self.face_mesh = self.mp_face_mesh.FaceMesh(
-            static_image_mode=True,
-            max_num_faces=1,
-            refine_landmarks=True,
-            min_detection_confidence=0.5
-        )
+        self.static_image_mode = static_image_mode
+        self.max_num_faces = max_num_faces
+        # One FaceMesh graph per refine_landmarks setting, created on first use
+        self._face_meshes = {}
+        self.refine_landmarks = refine_landmarks
+        self.face_mesh = self._get_face_mesh(refine_landmarks)
         
         # FIXED: Corrected lip landmarks using MediaPipe's standard indices
         # These are the actual lip contour landmarks in MediaPipe FaceMesh
@@ -48,265 +102,449 @@ class VirtualMakeupProcessor:
             435, 367, 364, 430, 394, 395, 369, 262, 249, 390, 373, 374
         ]
 
+    def _get_face_mesh(self, refine_landmarks):
+        face_mesh = self._face_meshes.get(refine_landmarks)
+        if face_mesh is None:
+            face_mesh = self._face_meshes[refine_landmarks] = self.mp_face_mesh.FaceMesh(
+                static_image_mode=self.static_image_mode,
+                max_num_faces=self.max_num_faces,
+                refine_landmarks=refine_landmarks,
+                min_detection_confidence=0.5
+            )
+        return face_mesh
+
+    def use_preset(self, preset):
+        """Switch detection refinement, detection resolution and blur kernels to a render preset.
+
+        ``preset`` is an entry of app.utils.render_presets.RENDER_PRESETS;
+        the settings stay in effect for the following calls.
+        """
+        self.refine_landmarks = preset["refine_landmarks"]
+        self.face_mesh = self._get_face_mesh(self.refine_landmarks)
+        self.detection_max_side = preset["detection_max_side"]
+        self.blur_fractions = {
+            makeup_type: (preset["blur"].get(makeup_type, fraction), minimum)
+            for makeup_type, (fraction, minimum) in self.BLUR_FRACTIONS.items()
+        }
+
+    def close(self):
+        """Release the FaceMesh graphs"""
+        for face_mesh in self._face_meshes.values():
+            face_mesh.close()
+        self._face_meshes.clear()
+
+    def reset_timings(self):
+        """Start collecting stage durations for a new request"""
+        self.timings = {}
+
+    def timed(self, stage):
+        """Context manager timing a pipeline stage into the instrumentation and self.timings"""
+        return timed(self.instrumentation, stage, self.timings)
+
     def parse_color_to_bgr(self, color_value):
-        """Convert color from various formats to BGR"""
-        try:
-            if not isinstance(color_value, str):
-                color_value = str(color_value)
-            
-            # Handle named colors with expanded color map
-            color_map = {
-                'red': '#FF0000',
-                'pink': '#FF69B4',
-                'nude': '#E3BC9A',
-                'coral': '#FF7F50',
-                'burgundy': '#800020',
-                'light': '#FFE4E1',
-                'medium': '#DEB887',
-                'dark': '#4B0082',
-                'tan': '#D2B48C',
-                'beige': '#F5F5DC',
-                'black': '#000000',
-                'white': '#FFFFFF',
-                'blue': '#0000FF',
-                'green': '#008000',
-                'yellow': '#FFFF00',
-                'purple': '#800080',
-                'orange': '#FFA500',
-                'brown': '#A52A2A',
-                'gray': '#808080',
-                'gold': '#FFD700',
-                'silver': '#C0C0C0',
-                'rose gold': '#B76E79'
-            }
-            
-            # Convert color name to hex if it's a named color (case insensitive)
-            color_value_lower = color_value.lower()
-            if color_value_lower in color_map:
-                print(f"Converting named color '{color_value}' to hex: {color_map[color_value_lower]}")
-                color_value = color_map[color_value_lower]
-            
-            # Handle RGBA format
-            if color_value.startswith('rgba(') and color_value.endswith(')'):
-                rgba_content = color_value[5:-1]
-                values = [float(x.strip()) for x in rgba_content.split(',')]
-                
-                if len(values) >= 3:
-                    r = int(min(255, max(0, values[0])))
-                    g = int(min(255, max(0, values[1])))
-                    b = int(min(255, max(0, values[2])))
-                    print(f"Converted RGBA color {color_value} to BGR: ({b}, {g}, {r})")
-                    return (b, g, r)
-            
-            # Handle RGB format
-            elif color_value.startswith('rgb(') and color_value.endswith(')'):
-                rgb_content = color_value[4:-1]
-                values = [float(x.strip()) for x in rgb_content.split(',')]
-                
-                if len(values) >= 3:
-                    r = int(min(255, max(0, values[0])))
-                    g = int(min(255, max(0, values[1])))
-                    b = int(min(255, max(0, values[2])))
-                    print(f"Converted RGB color {color_value} to BGR: ({b}, {g}, {r})")
-                    return (b, g, r)
-            
-            # Handle Hex format
-            else:
-                bgr = self.hex_to_bgr(color_value)
-                print(f"Converted hex color {color_value} to BGR: {bgr}")
-                return bgr
-                
-        except Exception as e:
-            print(f"Error parsing color {color_value}: {str(e)}")
-            # Return a more neutral default color (light pink) instead of red
-            return (180, 105, 255)  # Light pink in BGR
+        """Convert color from various formats to BGR (see ShadeRegistry)"""
+        return shade_registry.lookup(color_value)
     
     def hex_to_bgr(self, hex_color):
         """Convert hex color to BGR"""
-        try:
-            if not isinstance(hex_color, str):
-                hex_color = str(hex_color)
-            
-            # Remove '#' if present
-            if hex_color.startswith('#'):
-                hex_color = hex_color[1:]
-            
-            # Handle shorthand hex (e.g., #FFF)
-            if len(hex_color) == 3:
-                hex_color = ''.join([c*2 for c in hex_color])
-            
-            # Validate hex format
-            if not re.match(r'^[0-9A-Fa-f]{6}$', hex_color):
-                print(f"Invalid hex color format: {hex_color}")
-                return (180, 105, 255)  # Light pink in BGR
-            
-            # Convert to BGR
-            r = int(hex_color[0:2], 16)
-            g = int(hex_color[2:4], 16)
-            b = int(hex_color[4:6], 16)
-            
-            print(f"Converted hex {hex_color} to BGR: ({b}, {g}, {r})")
-            return (b, g, r)
-            
-        except Exception as e:
-            print(f"Error converting hex color {hex_color}: {str(e)}")
-            return (180, 105, 255)  # Light pink in BGR
+        return hex_to_bgr(hex_color)
         
     def get_landmarks(self, image):
-        """Get facial landmarks from image"""
+        """Get facial landmarks from image as an int32 array of shape (K, N, 2), one row per face"""
+        h, w = image.shape[:2]
+        self.instrumentation.record_image(w, h)
+
+        key = None
+        if self.landmark_cache is not None:
+            # Landmarks depend on the detection settings of the active preset
+            key = f"{self.landmark_cache.key_for(image)}:{int(self.refine_landmarks)}:{self.detection_max_side or 0}"
+            cached = self.landmark_cache.get(key)
+            if cached is not None:
+                landmarks = cached if len(cached) else None
+                self.instrumentation.record_face(landmarks is not None)
+                return landmarks
+
+        with self.timed("landmark"):
+            landmarks = self.detect_landmarks(image)
+        self.instrumentation.record_face(landmarks is not None)
+
+        if key is not None:
+            self.landmark_cache.put(key, landmarks if landmarks is not None else np.empty((0, 0, 2), dtype=np.int32))
+        return landmarks
+
+    def detect_landmarks(self, image):
+        """Run FaceMesh on a BGR image, bypassing the landmark cache.
+
+        Detection runs on a copy downscaled to detection_max_side; the
+        normalized landmarks are mapped back onto the full-size image.
+        Returns an int32 array of shape (K, N, 2) for the K faces found (up
+        to max_num_faces, all from one FaceMesh call), or None.
+        """
         try:
-            rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            h, w = image.shape[:2]
+            detection_image = image
+            if self.detection_max_side and max(h, w) > self.detection_max_side:
+                scale = self.detection_max_side / max(h, w)
+                detection_image = cv2.resize(
+                    image, (max(1, round(w * scale)), max(1, round(h * scale))),
+                    interpolation=cv2.INTER_AREA
+                )
+            rgb_image = cv2.cvtColor(detection_image, cv2.COLOR_BGR2RGB)
             results = self.face_mesh.process(rgb_image)
             
             if results.multi_face_landmarks:
-                landmarks = []
-                for face_landmarks in results.multi_face_landmarks:
-                    h, w = image.shape[:2]
-                    for landmark in face_landmarks.landmark:
-                        x = int(landmark.x * w)
-                        y = int(landmark.y * h)
-                        landmarks.append((x, y))
-                return landmarks
+                points = [
+                    [(landmark.x, landmark.y) for landmark in face_landmarks.landmark]
+                    for face_landmarks in results.multi_face_landmarks
+                ]
+                landmarks = np.array(points, dtype=np.float64) * np.array([w, h], dtype=np.float64)
+                return landmarks.astype(np.int32)
             return None
-        except Exception as e:
+        except Exception:
+            self.instrumentation.record_error("landmark")
+            logger.exception("Face landmark detection failed")
             return None
     
     def get_lip_contour(self, landmarks):
         """Get accurate lip contour points"""
-        try:
-            # More accurate lip landmarks for MediaPipe FaceMesh
-            outer_lip_indices = [
-                61, 146, 91, 181, 84, 17, 314, 405, 320, 307, 375, 321, 308, 324, 318,
-                402, 317, 14, 87, 178, 88, 95, 78, 191, 80, 81, 82, 13, 312, 311, 310, 415
-            ]
-            
-            inner_lip_indices = [
-                78, 95, 88, 178, 87, 14, 317, 402, 318, 324, 308, 320, 307, 375, 321, 
-                12, 15, 16, 17, 18, 200, 199, 175, 0, 269, 270, 267, 272, 271
-            ]
-            
-            # Use outer contour for better coverage
-            lip_points = []
-            for idx in outer_lip_indices:
-                if idx < len(landmarks):
-                    lip_points.append(landmarks[idx])
-            
-            return lip_points
-        except Exception as e:
-            return []
+        # Use outer contour for better coverage
+        indices = self.OUTER_LIP_INDICES
+        if len(landmarks) <= indices.max():
+            indices = indices[indices < len(landmarks)]
+        return landmarks[indices]
+
+    def get_face_scale(self, landmarks):
+        """Inter-ocular distance in pixels, used to size regions to the face"""
+        left, right = self.EYE_OUTER_CORNERS
+        if len(landmarks) <= max(left, right):
+            return self.REFERENCE_INTEROCULAR
+        distance = float(np.linalg.norm(landmarks[left] - landmarks[right]))
+        return distance if distance > 1 else self.REFERENCE_INTEROCULAR
     
     def create_natural_cheek_area(self, landmarks, is_left=True):
-        """Create natural oval-shaped cheek area with reduced size"""
-        try:
-            if is_left:
-                key_points = [116, 117, 118, 50, 36, 205, 206, 207, 213, 192, 147]
-            else:
-                key_points = [345, 346, 347, 280, 266, 425, 426, 427, 436, 416, 376]
-            
-            points = []
-            for idx in key_points:
-                if idx < len(landmarks):
-                    points.append(landmarks[idx])
-            
-            if len(points) < 4:
-                return []
-                
-            center_x = sum(p[0] for p in points) / len(points)
-            center_y = sum(p[1] for p in points) / len(points)
-            
-            oval_points = []
-            # Reduced size for more natural look
-            a = 35  # Horizontal radius
-            b = 25  # Vertical radius
-            
-            for angle in range(0, 360, 20):
-                rad = np.radians(angle)
-                x = int(center_x + a * np.cos(rad))
-                y = int(center_y + b * np.sin(rad))
-                oval_points.append((x, y))
-            
-            return oval_points
-        except Exception as e:
+        """Create natural oval-shaped cheek area scaled to the face size"""
+        key_points = self.LEFT_CHEEK_KEY_POINTS if is_left else self.RIGHT_CHEEK_KEY_POINTS
+        if len(landmarks) <= key_points.max():
+            key_points = key_points[key_points < len(landmarks)]
+        if len(key_points) < 4:
             return []
+
+        center = landmarks[key_points].mean(axis=0)
+        radii = self.CHEEK_RADII * self.get_face_scale(landmarks)
+        return (center + self.UNIT_ELLIPSE * radii).astype(np.int32)
     
-    def apply_makeup_with_gradient(self, image, landmarks, area_landmarks, color, intensity, makeup_type):
-        """Apply makeup with natural gradient - IMPROVED"""
-        try:
-            if not landmarks or intensity == 0:
-                return image
-                
-            mask = np.zeros(image.shape[:2], dtype=np.uint8)
-            
-            if area_landmarks == "LEFT_CHEEK":
-                points = self.create_natural_cheek_area(landmarks, is_left=True)
-            elif area_landmarks == "RIGHT_CHEEK":
-                points = self.create_natural_cheek_area(landmarks, is_left=False)
-            elif area_landmarks == "LIPS":
-                # Use improved lip contour
-                points = self.get_lip_contour(landmarks)
-            else:
-                # Handle list of landmark indices
-                points = []
-                for idx in area_landmarks:
-                    if idx < len(landmarks):
-                        points.append(landmarks[idx])
-                    
-            if len(points) < 3:
-                return image
-                
-            points = np.array(points, dtype=np.int32)
-            
-            # Create convex hull for better shape
+    def estimate_skin_tone(self, image, landmarks):
+        """Median CIELAB color (L in 0-100) of cheek and forehead skin on the first face.
+
+        Square patches are sampled around both cheek centers and a few
+        forehead points, away from lips, eyes and brows. Returns (L, a, b)
+        or None if no patch falls inside the image.
+        """
+        face = np.asarray(landmarks)
+        if face.ndim == 3:
+            face = face[0]
+        centers = [face[self.FOREHEAD_POINTS[self.FOREHEAD_POINTS < len(face)]]]
+        for key_points in (self.LEFT_CHEEK_KEY_POINTS, self.RIGHT_CHEEK_KEY_POINTS):
+            key_points = key_points[key_points < len(face)]
+            if len(key_points):
+                centers.append(face[key_points].mean(axis=0, keepdims=True))
+        centers = np.concatenate(centers).astype(np.int32)
+
+        h, w = image.shape[:2]
+        radius = max(1, int(self.get_face_scale(face) * self.SKIN_PATCH_RADIUS))
+        patches = []
+        for x, y in centers:
+            x0, x1 = max(0, x - radius), min(w, x + radius + 1)
+            y0, y1 = max(0, y - radius), min(h, y + radius + 1)
+            if x0 < x1 and y0 < y1:
+                patches.append(image[y0:y1, x0:x1].reshape(-1, 3))
+        if not patches:
+            return None
+
+        pixels = np.concatenate(patches).astype(np.float32)[np.newaxis]
+        pixels *= 1.0 / 255.0
+        lab = cv2.cvtColor(pixels, cv2.COLOR_BGR2Lab)[0]
+        return tuple(float(value) for value in np.median(lab, axis=0))
+
+    def get_region_points(self, landmarks, area_landmarks):
+        """Get the outline points of a makeup region"""
+        if area_landmarks == "LEFT_CHEEK":
+            return self.create_natural_cheek_area(landmarks, is_left=True)
+        elif area_landmarks == "RIGHT_CHEEK":
+            return self.create_natural_cheek_area(landmarks, is_left=False)
+        elif area_landmarks == "LIPS":
+            # Use improved lip contour
+            return self.get_lip_contour(landmarks)
+        # Handle list of landmark indices
+        points = []
+        for idx in area_landmarks:
+            if idx < len(landmarks):
+                points.append(landmarks[idx])
+        return points
+
+    def get_face_polygons(self, landmarks, areas):
+        """Outline points of ``areas`` on every face, skipping degenerate ones.
+
+        ``landmarks`` is a single face (N, 2) or several faces (K, N, 2).
+        """
+        faces = landmarks if landmarks.ndim == 3 else landmarks[np.newaxis]
+        polygons = []
+        for face in faces:
+            for area in areas:
+                points = self.get_region_points(face, area)
+                if len(points) >= 3:
+                    polygons.append(points)
+        return polygons
+
+    def get_blur_kernel_size(self, image_shape, makeup_type):
+        """Gaussian kernel size for a region, relative to the image size"""
+        # Less blur for lips to maintain shape definition, more for cheeks
+        # for natural blending
+        fraction, minimum = self.blur_fractions.get(makeup_type, self.blur_fractions["cheeks"])
+        kernel_size = max(minimum, int(min(image_shape[:2]) * fraction))
+        if kernel_size % 2 == 0:
+            kernel_size += 1
+        return kernel_size
+
+    def build_region_mask(self, image_shape, polygons, makeup_type, kernel_size):
+        """Rasterize regions into one uint8 mask covering only their padded bounding box.
+
+        ``polygons`` holds the outlines of every region sharing a color, e.g.
+        both cheeks of all faces. Returns (mask, (y0, y1, x0, x1)), or
+        (None, None) if the regions lie outside the image. The box is padded
+        by a full kernel so blurring the crop gives the same result as
+        blurring a full-frame mask.
+        """
+        h, w = image_shape[:2]
+        polygons = [np.asarray(points, dtype=np.int32).reshape(-1, 2) for points in polygons]
+        stacked = np.concatenate(polygons)
+        x0 = max(0, int(stacked[:, 0].min()) - kernel_size)
+        x1 = min(w, int(stacked[:, 0].max()) + kernel_size + 1)
+        y0 = max(0, int(stacked[:, 1].min()) - kernel_size)
+        y1 = min(h, int(stacked[:, 1].max()) + kernel_size + 1)
+        if x0 >= x1 or y0 >= y1:
+            return None, None
+
+        mask = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+        offset = np.array([x0, y0], dtype=np.int32)
+        for points in polygons:
+            points = points - offset
             if makeup_type == "lips":
                 # For lips, use the points as-is for more natural shape
                 cv2.fillPoly(mask, [points], 255)
             else:
                 # For cheeks, use convex hull
-                hull = cv2.convexHull(points)
-                cv2.fillPoly(mask, [hull], 255)
-            
-            # Adjust blur based on makeup type and image size
-            if makeup_type == "lips":
-                # Less blur for lips to maintain shape definition
-                kernel_size = max(3, int(min(image.shape[:2]) * 0.008))
-            else:
-                # More blur for cheeks for natural blending
-                kernel_size = max(15, int(min(image.shape[:2]) * 0.025))
-                
-            if kernel_size % 2 == 0:
-                kernel_size += 1
-            mask = cv2.GaussianBlur(mask, (kernel_size, kernel_size), 0)
-            
-            # Apply color with better blending
-            color_layer = np.full_like(image, color, dtype=np.uint8)
-            mask_3d = np.stack([mask/255.0] * 3, axis=2)
-            intensity_factor = intensity / 100.0
-            
-            if makeup_type == "lips":
-                # Better lip color blending - use multiply and overlay blend modes
-                alpha = intensity_factor * 0.7
-                
-                # Convert to float for better blending
-                image_float = image.astype(np.float64)
-                color_float = color_layer.astype(np.float64)
-                
-                # Multiply blend for more natural lip color
-                multiply_blend = (image_float * color_float) / 255.0
-                
-                # Combine with original
-                result = image_float * (1 - mask_3d * alpha) + multiply_blend * mask_3d * alpha
-                result = np.clip(result, 0, 255).astype(np.uint8)
-            else:
-                # Cheek blending
-                alpha = intensity_factor * 0.4
-                result = image * (1 - mask_3d * alpha) + color_layer * mask_3d * alpha
-                result = result.astype(np.uint8)
-            
-            return result
-        except Exception as e:
-            print(f"Error in apply_makeup_with_gradient: {e}")
+                cv2.fillPoly(mask, [cv2.convexHull(points)], 255)
+        return mask, (y0, y1, x0, x1)
+
+    def blur_mask(self, mask, kernel_size):
+        return cv2.GaussianBlur(mask, (kernel_size, kernel_size), 0)
+
+    @staticmethod
+    def _runs(flags):
+        """(start, end) of each run of True values in a 1-D boolean array"""
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], flags.view(np.int8), [0]))))
+        return edges.reshape(-1, 2)
+
+    def build_layer(self, image_shape, landmarks, areas, color, intensity, makeup_type):
+        """Blurred alpha mask of one makeup layer: ``areas`` on every face.
+
+        Returns a (mask, box, color, intensity, makeup_type) layer for
+        composite_layers(), or None if there is nothing to draw.
+        """
+        if landmarks is None or len(landmarks) == 0 or intensity <= 0:
+            return None
+        polygons = self.get_face_polygons(np.asarray(landmarks), areas)
+        if not polygons:
+            return None
+        return self.build_polygon_layer(image_shape, polygons, color, intensity, makeup_type)
+
+    def build_region_layers(self, image_shape, landmarks, areas, color, intensity, makeup_type):
+        """One layer per region of ``areas`` on every face, in paint order.
+
+        Unlike build_layer(), regions that overlap (cheeks of neighbouring
+        faces, or of a small face once blurred) are blended one after the
+        other, as separate passes over the image would, instead of their
+        union being blended once.
+        """
+        if landmarks is None or len(landmarks) == 0 or intensity <= 0:
+            return []
+        layers = []
+        for points in self.get_face_polygons(np.asarray(landmarks), areas):
+            layer = self.build_polygon_layer(image_shape, [points], color, intensity, makeup_type)
+            if layer is not None:
+                layers.append(layer)
+        return layers
+
+    def build_polygon_layer(self, image_shape, polygons, color, intensity, makeup_type):
+        """Blurred alpha mask of the union of ``polygons`` as a composite_layers() layer, or None"""
+        kernel_size = self.get_blur_kernel_size(image_shape, makeup_type)
+        with self.timed("mask"):
+            mask, box = self.build_region_mask(image_shape, polygons, makeup_type, kernel_size)
+        if mask is None:
+            return None
+        with self.timed("blur"):
+            mask = self.blur_mask(mask, kernel_size)
+        return mask, box, color, intensity, makeup_type
+
+    def describe_layers(self, image_shape, landmarks):
+        """Outline polygons and blending parameters of every makeup layer.
+
+        For clients that composite the makeup themselves: each entry of
+        MAKEUP_LAYERS maps to its blend mode, full-intensity opacity, blur
+        kernel size and the polygons of its regions on every face (cheek
+        ovals already as the convex hulls that get filled).
+        """
+        layers = {}
+        for makeup_type, areas in self.MAKEUP_LAYERS:
+            polygons = []
+            if landmarks is not None and len(landmarks):
+                polygons = [np.asarray(points, dtype=np.int32).reshape(-1, 2)
+                            for points in self.get_face_polygons(np.asarray(landmarks), areas)]
+            if makeup_type != "lips":
+                polygons = [cv2.convexHull(points).reshape(-1, 2) for points in polygons]
+            mode, opacity = self.BLEND_MODES[makeup_type]
+            layers[makeup_type] = {
+                "blend_mode": mode,
+                "opacity": opacity,
+                "blur_kernel": self.get_blur_kernel_size(image_shape, makeup_type),
+                "polygons": [points.tolist() for points in polygons],
+            }
+        return layers
+
+    def build_alpha_masks(self, image_shape, landmarks):
+        """Blurred full-intensity masks of all layers, stacked over their common box.
+
+        Returns (masks, (y0, y1, x0, x1)) where masks is a uint8 array of
+        shape (h, w, len(MAKEUP_LAYERS)) with one channel per layer in paint
+        order, or (None, None) if no layer has anything to draw.
+        """
+        layers = []
+        for channel, (makeup_type, areas) in enumerate(self.MAKEUP_LAYERS):
+            layer = self.build_layer(image_shape, landmarks, areas, None, 100, makeup_type)
+            if layer is not None:
+                layers.append((channel, layer[0], layer[1]))
+        if not layers:
+            return None, None
+
+        y0 = min(box[0] for _, _, box in layers)
+        y1 = max(box[1] for _, _, box in layers)
+        x0 = min(box[2] for _, _, box in layers)
+        x1 = max(box[3] for _, _, box in layers)
+        masks = np.zeros((y1 - y0, x1 - x0, len(self.MAKEUP_LAYERS)), dtype=np.uint8)
+        for channel, mask, (ly0, ly1, lx0, lx1) in layers:
+            masks[ly0 - y0:ly1 - y0, lx0 - x0:lx1 - x0, channel] = mask
+        return masks, (y0, y1, x0, x1)
+
+    def blend_pixels(self, pixels, mask, color, intensity, makeup_type):
+        """Blend a color into float32 BGR pixels through a uint8 mask of the same size"""
+        mode, opacity = self.BLEND_MODES[makeup_type]
+        alpha = intensity / 100.0 * opacity
+
+        weight = mask.astype(np.float32)
+        weight *= alpha / 255.0
+        weight = weight[..., np.newaxis]
+        color_float = np.asarray(color, dtype=np.float32)
+
+        if mode == "multiply":
+            # Multiply blend for more natural lip color:
+            # p * (1 - w) + (p * c / 255) * w == p * (1 - w * (1 - c / 255))
+            pixels *= 1.0 - weight * (1.0 - color_float / 255.0)
+        else:
+            # Normal blending: p * (1 - w) + c * w
+            pixels += (color_float - pixels) * weight
+
+    def composite_layers(self, image, layers):
+        """Resolve makeup layers into a BGR image in place, in a single pass.
+
+        ``layers`` are build_layer() or build_region_layers() results in
+        paint order; where layers overlap, each is blended over the result
+        of the ones before it. Their union is
+        split into the column strips the masks actually cover; each strip is
+        converted to float32 once, every layer overlapping it is blended in
+        with its own blend mode, and the strip is written back once. A layer
+        therefore only costs its own pixels.
+        """
+        if not layers:
             return image
-        
+        ux0 = min(box[2] for _, box, *_ in layers)
+        ux1 = max(box[3] for _, box, *_ in layers)
+        covered = np.zeros(ux1 - ux0, dtype=bool)
+        for mask, (y0, y1, x0, x1), *_ in layers:
+            covered[x0 - ux0:x1 - ux0] |= mask.any(axis=0)
+
+        for cx0, cx1 in self._runs(covered):
+            sx0, sx1 = ux0 + cx0, ux0 + cx1
+            parts = []
+            for mask, (y0, y1, x0, x1), color, intensity, makeup_type in layers:
+                lx0, lx1 = max(x0, sx0), min(x1, sx1)
+                if lx0 >= lx1:
+                    continue
+                columns = mask[:, lx0 - x0:lx1 - x0]
+                rows = np.flatnonzero(columns.any(axis=1))
+                if not len(rows):
+                    continue
+                parts.append((columns[rows[0]:rows[-1] + 1], y0 + rows[0], y0 + rows[-1] + 1, lx0, lx1,
+                              color, intensity, makeup_type))
+            if not parts:
+                continue
+
+            sy0 = min(part[1] for part in parts)
+            sy1 = max(part[2] for part in parts)
+            region = image[sy0:sy1, sx0:sx1]
+            pixels = region.astype(np.float32)
+            for weights, ly0, ly1, lx0, lx1, color, intensity, makeup_type in parts:
+                self.blend_pixels(
+                    pixels[ly0 - sy0:ly1 - sy0, lx0 - sx0:lx1 - sx0],
+                    weights, color, intensity, makeup_type
+                )
+            np.clip(pixels, 0, 255, out=pixels)
+            np.copyto(region, pixels, casting="unsafe")
+        return image
+
+    def apply_makeup_with_gradient(self, image, landmarks, area_landmarks, color, intensity, makeup_type):
+        """Apply a single makeup layer to a BGR image, modifying it in place.
+
+        ``area_landmarks`` is a region name or a list of them, drawn on every
+        face in ``landmarks``. Returns the same image for convenience.
+        """
+        try:
+            areas = [area_landmarks] if isinstance(area_landmarks, str) else area_landmarks
+            layers = self.build_region_layers(image.shape, landmarks, areas, color, intensity, makeup_type)
+            if layers:
+                with self.timed("blend"):
+                    self.composite_layers(image, layers)
+            return image
+        except Exception:
+            self.instrumentation.record_error("apply_makeup_with_gradient")
+            logger.exception("Failed to apply %s makeup", makeup_type)
+            return image
+
+    def apply_makeup_to_landmarks(self, image, landmarks, lips_bgr, lips_intensity, cheeks_bgr, cheeks_intensity):
+        """Apply all makeup layers to a BGR image in place, using already detected landmarks.
+
+        ``landmarks`` may hold one face (N, 2) or several (K, N, 2). Each
+        region of each face gets its own alpha mask, so overlapping regions
+        look as they did when every region was a separate pass, and all of
+        them are then composited in a single pass.
+        """
+        colors = {
+            "cheeks": (cheeks_bgr, cheeks_intensity),
+            "lips": (lips_bgr, lips_intensity),
+        }
+        try:
+            layers = []
+            for makeup_type, areas in self.MAKEUP_LAYERS:
+                color, intensity = colors[makeup_type]
+                layers.extend(self.build_region_layers(image.shape, landmarks, areas, color, intensity, makeup_type))
+            if layers:
+                with self.timed("blend"):
+                    self.composite_layers(image, layers)
+        except Exception:
+            self.instrumentation.record_error("apply_makeup_to_landmarks")
+            logger.exception("Failed to apply makeup layers")
+        return image
+
     def apply_makeup(self, image, lips_color, lips_intensity, cheeks_color, cheeks_intensity):
         """Apply makeup to image - IMPROVED"""
         try:
@@ -314,42 +552,25 @@ class VirtualMakeupProcessor:
                 return None
                 
             if isinstance(image, Image.Image):
-                image = np.array(image)
-                image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-            
-            result_image = image.copy()
+                # The conversion already yields a new buffer to draw on
+                result_image = cv2.cvtColor(np.asarray(image.convert("RGB")), cv2.COLOR_RGB2BGR)
+            else:
+                result_image = image.copy()
             
             landmarks = self.get_landmarks(result_image)
             
-            if landmarks:
-                print(f"Found {len(landmarks)} landmarks")
-                
+            if landmarks is not None:
                 lips_bgr = self.parse_color_to_bgr(lips_color)
                 cheeks_bgr = self.parse_color_to_bgr(cheeks_color)
-                
-                # Apply cheeks first, then lips
-                if cheeks_intensity > 0:
-                    result_image = self.apply_makeup_with_gradient(
-                        result_image, landmarks, "LEFT_CHEEK", 
-                        cheeks_bgr, cheeks_intensity, "cheeks"
-                    )
-                    result_image = self.apply_makeup_with_gradient(
-                        result_image, landmarks, "RIGHT_CHEEK", 
-                        cheeks_bgr, cheeks_intensity, "cheeks"
-                    )
-                
-                if lips_intensity > 0:
-                    # Use the improved lip application
-                    result_image = self.apply_makeup_with_gradient(
-                        result_image, landmarks, "LIPS", 
-                        lips_bgr, lips_intensity, "lips"
-                    )
-            else:
-                print("No landmarks detected")
+                self.apply_makeup_to_landmarks(
+                    result_image, landmarks,
+                    lips_bgr, lips_intensity, cheeks_bgr, cheeks_intensity
+                )
             
-            result_image = cv2.cvtColor(result_image, cv2.COLOR_BGR2RGB)
+            cv2.cvtColor(result_image, cv2.COLOR_BGR2RGB, dst=result_image)
             return Image.fromarray(result_image)
             
-        except Exception as e:
-            print(f"Error in apply_makeup: {e}")
+        except Exception:
+            self.instrumentation.record_error("apply_makeup")
+            logger.exception("Failed to apply makeup")
             return image if isinstance(image, Image.Image) else Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
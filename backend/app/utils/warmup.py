@@ -0,0 +1,45 @@
+import asyncio
+import importlib
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Heavy modules the API imports lazily; they are preloaded in the background
+# once the server is up so the first try-on does not pay for them
+API_WARMUP_MODULES = [name.strip() for name in os.getenv("API_WARMUP_MODULES", "numpy,cv2").split(",") if name.strip()]
+
+# Import duration (ms) of every module preloaded so far
+warm_up_timings = {}
+
+_task = None
+
+
+def preload_modules(names) -> dict:
+    """Import ``names`` one by one and return how long each took (ms)"""
+    timings = {}
+    for name in names:
+        start = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            logger.exception("Failed to preload %s", name)
+            continue
+        timings[name] = round((time.perf_counter() - start) * 1000, 1)
+    return timings
+
+
+async def _warm_up(names):
+    # Let startup finish and the server start accepting requests first
+    await asyncio.sleep(0)
+    timings = await asyncio.to_thread(preload_modules, names)
+    warm_up_timings.update(timings)
+    logger.info("Preloaded %s", ", ".join(f"{name} ({ms} ms)" for name, ms in timings.items()))
+
+
+def start_warm_up(names=None):
+    """Preload heavy modules in a background thread without delaying startup"""
+    global _task
+    if _task is None:
+        _task = asyncio.create_task(_warm_up(API_WARMUP_MODULES if names is None else names))
@@ -0,0 +1,140 @@
+"""Allocation benchmark of one try-on render, from upload bytes to encoded result.
+
+Compares the in-place pipeline used by the render workers (decode_image
+straight to BGR, makeup composited into that buffer, encode_image from it)
+with the former PIL round trip (PIL decode, np.array, RGB->BGR, copy,
+render, BGR->RGB, Image.fromarray, PIL encode). For each sample image and
+resolution it reports the peak memory allocated during a request, also as
+a multiple of one decoded frame, the number of frame-sized buffers alive
+right after rendering, and the median latency. Memory is measured with
+tracemalloc, which sees NumPy/OpenCV arrays but not Pillow's internal image
+buffers, so the PIL round trip is if anything under-reported.
+
+Usage (from the backend directory):
+
+    python -m benchmarks.bench_allocations
+    python -m benchmarks.bench_allocations --resolutions 12mp --output alloc.json
+"""
+import argparse
+import io
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from app.utils.image_encode import encode_image
+from app.utils.image_ingest import decode_image, MAKEUP_DETECTION_MAX_SIDE
+from app.utils.virtual_makeup import VirtualMakeupProcessor
+from benchmarks.bench_virtual_makeup import SAMPLE_IMAGES, RESOLUTIONS, load_images, resize_short_side
+
+LIPS = ((32, 0, 128), 70)
+CHEEKS = ((180, 105, 255), 50)
+
+
+def render_in_place(processor, upload: bytes) -> bytes:
+    image = decode_image(upload)
+    landmarks = processor.get_landmarks(image)
+    if landmarks is not None:
+        processor.apply_makeup_to_landmarks(image, landmarks, *LIPS, *CHEEKS)
+    return encode_image(image, "jpeg")
+
+
+def render_pil_roundtrip(processor, upload: bytes) -> bytes:
+    image = np.array(Image.open(io.BytesIO(upload)).convert("RGB"))
+    image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+    result = image.copy()
+    landmarks = processor.get_landmarks(result)
+    if landmarks is not None:
+        processor.apply_makeup_to_landmarks(result, landmarks, *LIPS, *CHEEKS)
+    result = Image.fromarray(cv2.cvtColor(result, cv2.COLOR_BGR2RGB))
+    output = io.BytesIO()
+    result.save(output, format="JPEG", quality=80)
+    return output.getvalue()
+
+
+PIPELINES = {"in_place": render_in_place, "pil_roundtrip": render_pil_roundtrip}
+
+
+def measure(processor, pipeline, upload: bytes, frame_bytes: int, iterations: int) -> dict:
+    pipeline(processor, upload)  # warm up, and fill the landmark cache
+    durations = []
+    peak = 0
+    frames_at_peak = 0
+    for _ in range(iterations):
+        tracemalloc.start()
+        start = time.perf_counter()
+        pipeline(processor, upload)
+        durations.append((time.perf_counter() - start) * 1000)
+        _, run_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        peak = max(peak, run_peak)
+
+    # Count the frame-sized buffers alive at the moment of the peak
+    tracemalloc.start()
+    snapshots = []
+    original = processor.apply_makeup_to_landmarks
+
+    def snapshot_after(*args, **kwargs):
+        result = original(*args, **kwargs)
+        snapshots.append(tracemalloc.take_snapshot())
+        return result
+
+    processor.apply_makeup_to_landmarks = snapshot_after
+    try:
+        pipeline(processor, upload)
+    finally:
+        processor.apply_makeup_to_landmarks = original
+        tracemalloc.stop()
+    if snapshots:
+        frames_at_peak = sum(1 for stat in snapshots[0].statistics("traceback") if stat.size >= frame_bytes * 0.9)
+
+    return {
+        "peak_mb": round(peak / 2**20, 2),
+        "peak_frames": round(peak / frame_bytes, 2),
+        "frame_buffers_after_render": frames_at_peak,
+        "p50_ms": round(float(np.median(durations)), 2),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", nargs="+", default=SAMPLE_IMAGES, help="sample image names in frontend/public/images")
+    parser.add_argument("--resolutions", nargs="+", default=list(RESOLUTIONS), choices=list(RESOLUTIONS))
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--output", type=Path, help="write results to this JSON file")
+    args = parser.parse_args(argv)
+
+    # A landmark cache keeps FaceMesh out of the comparison: both pipelines detect on the same pixels
+    from app.utils.landmark_cache import LandmarkCache
+    processor = VirtualMakeupProcessor(landmark_cache=LandmarkCache(), detection_max_side=MAKEUP_DETECTION_MAX_SIDE)
+    images = list(load_images(args.images, synthetic=False))
+    results = {}
+    for resolution in sorted(args.resolutions, key=RESOLUTIONS.get):
+        for name, image in images:
+            image = resize_short_side(image, RESOLUTIONS[resolution])
+            upload = encode_image(image, "jpeg", 90)
+            case = f"{name}@{resolution}"
+            results[case] = {
+                pipeline: measure(processor, fn, upload, image.nbytes, args.iterations)
+                for pipeline, fn in PIPELINES.items()
+            }
+            summary = "  ".join(
+                f"{pipeline}: peak={stats['peak_mb']}MB ({stats['peak_frames']}x frame, "
+                f"{stats['frame_buffers_after_render']} live) p50={stats['p50_ms']}ms"
+                for pipeline, stats in results[case].items()
+            )
+            print(f"{case:28s} {image.shape[1]}x{image.shape[0]}  {summary}")
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+        print(f"Wrote {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,275 @@
+"""Benchmark of the virtual makeup pipeline with a per-stage latency breakdown.
+
+Runs decode, landmark detection, mask build, blur, blend and encode over the
+sample face photos shipped in frontend/public/images (plus synthetic noisy
+and three-face group variants of them) at several resolutions, and reports
+p50/p95/p99 latency and peak allocation per stage together with the process
+peak RSS.
+
+Every case is rendered with each render preset (--presets, default all).
+Besides latency, each preset's output is compared with the "hq" render of
+the same case: PSNR (dB) at the hq size and the encoded size in KB, so the
+quality given up for the speed gained is visible.
+
+Usage (from the backend directory):
+
+    python -m benchmarks.bench_virtual_makeup --output bench.json
+    python -m benchmarks.bench_virtual_makeup --baseline bench.json
+
+With --baseline the run is compared against a previous JSON result and the
+command exits with status 1 if any stage's p50 regressed by more than
+--threshold (default 15%).
+"""
+import argparse
+import json
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from app.utils.image_encode import encode_image
+from app.utils.image_ingest import decode_image, MAKEUP_DETECTION_MAX_SIDE
+from app.utils.makeup_tasks import MAKEUP_MAX_FACES
+from app.utils.render_presets import RENDER_PRESETS, PRESET_ORDER
+from app.utils.virtual_makeup import VirtualMakeupProcessor
+
+SAMPLE_DIR = Path(__file__).resolve().parents[2] / "frontend" / "public" / "images"
+SAMPLE_IMAGES = ["guide1.png", "studio.png", "phonelipstick.png", "goiymakeup1.png"]
+
+# Short side of each benchmarked resolution
+RESOLUTIONS = {"480p": 480, "1080p": 1080, "12mp": 3000}
+
+STAGES = ["decode", "landmark", "mask", "blur", "blend", "encode"]
+
+# BGR color and intensity of each layer in VirtualMakeupProcessor.MAKEUP_LAYERS
+SHADES = {
+    "cheeks": ((180, 105, 255), 50),
+    "lips": ((32, 0, 128), 70),
+}
+
+
+def load_images(names, synthetic: bool):
+    """Yield (name, BGR image) for the sample photos and their synthetic variants"""
+    rng = np.random.default_rng(0)
+    for name in names:
+        image = cv2.imread(str(SAMPLE_DIR / name), cv2.IMREAD_COLOR)
+        if image is None:
+            print(f"Skipping missing sample image {name}", file=sys.stderr)
+            continue
+        yield name, image
+        if synthetic:
+            # The same face on a noisy, padded canvas: harder to compress and
+            # the face covers a smaller share of the frame
+            h, w = image.shape[:2]
+            canvas = rng.integers(0, 256, (h * 2, w * 2, 3), dtype=np.uint8)
+            canvas[h // 2:h // 2 + h, w // 2:w // 2 + w] = image
+            yield f"synthetic:{name}", canvas
+            # A three-person "group photo", to check that multi-face
+            # rendering grows sub-linearly with the number of faces
+            yield f"group3:{name}", np.hstack([image, image, image])
+
+
+def resize_short_side(image, short_side: int):
+    h, w = image.shape[:2]
+    scale = short_side / min(h, w)
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+    return cv2.resize(image, (round(w * scale), round(h * scale)), interpolation=interpolation)
+
+
+class StageTimer:
+    """Collects durations (ms) and peak Python-tracked allocations (bytes) per stage"""
+
+    def __init__(self):
+        self.durations = {stage: [] for stage in STAGES}
+        self.peak_alloc = {stage: 0 for stage in STAGES}
+        self._pending = {}
+
+    def measure(self, stage, fn, *args, accumulate=False):
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        start = time.perf_counter()
+        result = fn(*args)
+        elapsed = (time.perf_counter() - start) * 1000
+        _, peak = tracemalloc.get_traced_memory()
+        self.peak_alloc[stage] = max(self.peak_alloc[stage], peak - before)
+        if accumulate:
+            self._pending[stage] = self._pending.get(stage, 0.0) + elapsed
+        else:
+            self.durations[stage].append(elapsed)
+        return result
+
+    def flush(self):
+        """Close an iteration: stages measured per region are summed into one sample"""
+        for stage, elapsed in self._pending.items():
+            self.durations[stage].append(elapsed)
+        self._pending = {}
+
+    def summary(self) -> dict:
+        summary = {}
+        for stage in STAGES:
+            samples = self.durations[stage]
+            if not samples:
+                continue
+            p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+            summary[stage] = {
+                "p50_ms": round(float(p50), 3),
+                "p95_ms": round(float(p95), 3),
+                "p99_ms": round(float(p99), 3),
+                "peak_alloc_mb": round(self.peak_alloc[stage] / 2**20, 2),
+            }
+        return summary
+
+
+def run_case(processor, image, iterations: int, warmup: int, preset: str = "standard") -> tuple:
+    settings = RENDER_PRESETS[preset]
+    processor.use_preset(settings)
+    upload = encode_image(image, "jpeg", 90)
+    timer = StageTimer()
+    for iteration in range(warmup + iterations):
+        if iteration == warmup:
+            timer = StageTimer()
+
+        decoded = timer.measure("decode", decode_image, upload, settings["max_side"])
+        landmarks = timer.measure("landmark", processor.detect_landmarks, decoded)
+        if landmarks is not None:
+            layers = []
+            for makeup_type, areas in processor.MAKEUP_LAYERS:
+                kernel_size = processor.get_blur_kernel_size(decoded.shape, makeup_type)
+                color, intensity = SHADES[makeup_type]
+                # One layer per region, as apply_makeup_to_landmarks() builds them
+                for points in processor.get_face_polygons(landmarks, areas):
+                    mask, box = timer.measure(
+                        "mask", processor.build_region_mask,
+                        decoded.shape, [points], makeup_type, kernel_size, accumulate=True
+                    )
+                    if mask is None:
+                        continue
+                    mask = timer.measure("blur", processor.blur_mask, mask, kernel_size, accumulate=True)
+                    layers.append((mask, box, color, intensity, makeup_type))
+            timer.measure("blend", processor.composite_layers, decoded, layers)
+        timer.flush()
+        output = timer.measure("encode", encode_image, decoded, "jpeg", settings["quality"])
+
+    result = {
+        "preset": preset,
+        "width": image.shape[1],
+        "height": image.shape[0],
+        "output_width": decoded.shape[1],
+        "output_height": decoded.shape[0],
+        "upload_kb": round(len(upload) / 1024, 1),
+        "output_kb": round(len(output) / 1024, 1),
+        "faces": len(landmarks) if landmarks is not None else 0,
+        "stages": timer.summary(),
+    }
+    result["total_p50_ms"] = round(sum(stage["p50_ms"] for stage in result["stages"].values()), 3)
+    return result, output
+
+
+def psnr(output: bytes, reference: bytes) -> float:
+    """PSNR (dB) of an encoded result against a reference render, compared at the reference size"""
+    image = cv2.imdecode(np.frombuffer(output, dtype=np.uint8), cv2.IMREAD_COLOR)
+    target = cv2.imdecode(np.frombuffer(reference, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image.shape != target.shape:
+        image = cv2.resize(image, (target.shape[1], target.shape[0]), interpolation=cv2.INTER_LINEAR)
+    return round(float(cv2.PSNR(image, target)), 2)
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (2**20 if sys.platform == "darwin" else 2**10), 1)
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Stages whose p50 got slower than the baseline by more than ``threshold``"""
+    regressions = []
+    for case, result in results["cases"].items():
+        previous = baseline.get("cases", {}).get(case)
+        if not previous:
+            continue
+        for stage, stats in result["stages"].items():
+            before = previous["stages"].get(stage, {}).get("p50_ms")
+            if before and stats["p50_ms"] > before * (1 + threshold):
+                regressions.append({
+                    "case": case,
+                    "stage": stage,
+                    "baseline_p50_ms": before,
+                    "p50_ms": stats["p50_ms"],
+                    "change": f"{(stats['p50_ms'] / before - 1) * 100:+.1f}%",
+                })
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", nargs="+", default=SAMPLE_IMAGES, help="sample image names in frontend/public/images")
+    parser.add_argument("--resolutions", nargs="+", default=list(RESOLUTIONS), choices=list(RESOLUTIONS))
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--max-faces", type=int, default=MAKEUP_MAX_FACES, help="faces detected and made up per image")
+    parser.add_argument("--presets", nargs="+", default=PRESET_ORDER, choices=PRESET_ORDER,
+                        help="render presets to benchmark; quality is measured against hq when it is included")
+    parser.add_argument("--no-synthetic", action="store_true", help="skip the synthetic noisy-canvas and group variants")
+    parser.add_argument("--output", type=Path, help="write results to this JSON file")
+    parser.add_argument("--baseline", type=Path, help="compare against a previous JSON result")
+    parser.add_argument("--threshold", type=float, default=0.15, help="allowed p50 slowdown per stage (0.15 = 15%%)")
+    args = parser.parse_args(argv)
+
+    processor = VirtualMakeupProcessor(detection_max_side=MAKEUP_DETECTION_MAX_SIDE, max_num_faces=args.max_faces)
+    images = list(load_images(args.images, synthetic=not args.no_synthetic))
+    results = {
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "opencv": cv2.__version__,
+            "numpy": np.__version__,
+            "iterations": args.iterations,
+            "detection_max_side": MAKEUP_DETECTION_MAX_SIDE,
+            "max_faces": args.max_faces,
+            "presets": {name: RENDER_PRESETS[name] for name in args.presets},
+        },
+        "cases": {},
+    }
+
+    tracemalloc.start()
+    # Smallest resolution first so the growing peak RSS can be attributed per resolution
+    for resolution in sorted(args.resolutions, key=RESOLUTIONS.get):
+        for name, image in images:
+            resized = resize_short_side(image, RESOLUTIONS[resolution])
+            # hq first, so the cheaper presets can be compared against its output
+            outputs = {}
+            for preset in sorted(args.presets, key=lambda preset: preset != "hq"):
+                case = f"{name}@{resolution}" + ("" if preset == "standard" else f":{preset}")
+                result, outputs[preset] = run_case(processor, resized, args.iterations, args.warmup, preset)
+                if "hq" in outputs:
+                    result["psnr_vs_hq_db"] = psnr(outputs[preset], outputs["hq"]) if preset != "hq" else None
+                result["peak_rss_mb"] = peak_rss_mb()
+                results["cases"][case] = result
+                stages = "  ".join(f"{stage}={stats['p50_ms']:.1f}" for stage, stats in result["stages"].items())
+                quality = f"  psnr={result['psnr_vs_hq_db']}dB" if result.get("psnr_vs_hq_db") is not None else ""
+                print(f"{case:48s} {result['output_width']}x{result['output_height']}  p50 ms: {stages}  "
+                      f"total={result['total_p50_ms']:.1f}  out={result['output_kb']}KB{quality}  rss={result['peak_rss_mb']}MB")
+    tracemalloc.stop()
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+        print(f"Wrote {args.output}")
+
+    if args.baseline:
+        regressions = compare(results, json.loads(args.baseline.read_text()), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression['case']} {regression['stage']}: "
+                  f"{regression['baseline_p50_ms']} -> {regression['p50_ms']} ms ({regression['change']})")
+        if regressions:
+            return 1
+        print(f"No stage regressed by more than {args.threshold:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+"""Import-time profile of the API application.
+
+Imports app.main in a fresh interpreter with ``-X importtime`` and reports
+the total import time, the slowest modules and whether any module that
+must stay lazily loaded (OpenCV, MediaPipe, pandas, NumPy) was imported
+before the app could serve a request.
+
+Usage (from the backend directory):
+
+    python -m benchmarks.import_profile
+    python -m benchmarks.import_profile --budget-ms 1500 --output imports.json
+
+Exits with status 1 if a lazy module was imported at startup or the total
+exceeds --budget-ms.
+"""
+import argparse
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+
+# Top-level packages that are imported on first use or by the background warm-up only
+LAZY_MODULES = ["cv2", "mediapipe", "pandas", "numpy"]
+
+
+def profile_imports(module: str = "app.main", runs: int = 3) -> list:
+    """(module, self µs, cumulative µs) per imported module, from the fastest of ``runs`` imports"""
+    best = None
+    for _ in range(runs):
+        completed = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+        )
+        entries = []
+        for line in completed.stderr.splitlines():
+            if not line.startswith("import time:") or "self [us]" in line:
+                continue
+            self_us, cumulative_us, name = line[len("import time:"):].split("|")
+            entries.append((name.strip(), int(self_us), int(cumulative_us)))
+        total = next((cumulative for name, _, cumulative in entries if name == module), 0)
+        if best is None or total < best[0]:
+            best = (total, entries)
+    return best[1]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--runs", type=int, default=3, help="imports to run; the fastest one is reported")
+    parser.add_argument("--top", type=int, default=15, help="number of slowest modules to list")
+    parser.add_argument("--budget-ms", type=float, help="fail if the total import time exceeds this")
+    parser.add_argument("--output", type=Path, help="write the profile to this JSON file")
+    args = parser.parse_args(argv)
+
+    entries = profile_imports(args.module, args.runs)
+    total_ms = next((cumulative for name, _, cumulative in entries if name == args.module), 0) / 1000
+    eager = sorted({name.split(".")[0] for name, _, _ in entries} & set(LAZY_MODULES))
+
+    print(f"{args.module} imported in {total_ms:.0f} ms ({len(entries)} modules)")
+    print(f"{'self ms':>9} {'cumul ms':>9}  module")
+    for name, self_us, cumulative_us in sorted(entries, key=lambda entry: entry[1], reverse=True)[:args.top]:
+        print(f"{self_us / 1000:9.1f} {cumulative_us / 1000:9.1f}  {name}")
+
+    if args.output:
+        args.output.write_text(json.dumps({
+            "module": args.module,
+            "total_ms": round(total_ms, 1),
+            "eager_lazy_modules": eager,
+            "modules": [{"name": name, "self_ms": self_us / 1000, "cumulative_ms": cumulative_us / 1000}
+                        for name, self_us, cumulative_us in entries],
+        }, indent=2))
+        print(f"Wrote {args.output}")
+
+    failed = False
+    if eager:
+        print(f"FAIL: imported at startup but should load lazily: {', '.join(eager)}")
+        failed = True
+    if args.budget_ms and total_ms > args.budget_ms:
+        print(f"FAIL: import time {total_ms:.0f} ms exceeds the {args.budget_ms:.0f} ms budget")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,3 @@
+# Lets pytest import the ``app`` package when run from the backend directory:
+#
+#     python -m pytest -q tests
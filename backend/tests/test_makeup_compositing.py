@@ -0,0 +1,127 @@
+"""Single-pass compositing against the original one-pass-per-region pipeline.
+
+The reference below is the blending of the original
+apply_makeup_with_gradient(): each region is filled into a full-frame
+mask, blurred and blended into the whole image before the next region.
+Both paths get the same region outlines, so only compositing is compared.
+"""
+import pytest
+
+np = pytest.importorskip("numpy")
+cv2 = pytest.importorskip("cv2")
+pytest.importorskip("mediapipe")
+
+from app.utils.virtual_makeup import VirtualMakeupProcessor
+
+# Float rounding plus the reference truncating to uint8 after every region
+TOLERANCE = 2
+
+LIPS = ((60, 40, 200), 80)
+CHEEKS = ((120, 110, 230), 60)
+
+
+@pytest.fixture(scope="module")
+def processor():
+    processor = VirtualMakeupProcessor()
+    yield processor
+    processor.close()
+
+
+def make_face(center_x, center_y, interocular=175.0, cheek_spread=1.0):
+    """Synthetic FaceMesh landmarks: eye corners, cheek key points and a lip outline"""
+    face = np.zeros((478, 2), dtype=np.float64)
+    face[:] = (center_x, center_y)
+    left, right = VirtualMakeupProcessor.EYE_OUTER_CORNERS
+    face[left] = (center_x - interocular / 2, center_y - 0.3 * interocular)
+    face[right] = (center_x + interocular / 2, center_y - 0.3 * interocular)
+
+    rng = np.random.default_rng(0)
+    for side, key_points in ((-1, VirtualMakeupProcessor.LEFT_CHEEK_KEY_POINTS),
+                             (1, VirtualMakeupProcessor.RIGHT_CHEEK_KEY_POINTS)):
+        cheek = (center_x + side * 0.4 * interocular * cheek_spread, center_y + 0.1 * interocular)
+        face[key_points] = cheek + rng.normal(0, 0.05 * interocular, (len(key_points), 2))
+
+    angles = np.linspace(0, 2 * np.pi, len(VirtualMakeupProcessor.OUTER_LIP_INDICES), endpoint=False)
+    face[VirtualMakeupProcessor.OUTER_LIP_INDICES] = np.stack([
+        center_x + 0.3 * interocular * np.cos(angles),
+        center_y + 0.45 * interocular + 0.1 * interocular * np.sin(angles),
+    ], axis=1)
+    return face.astype(np.int32)
+
+
+def make_image(h=480, w=640):
+    rng = np.random.default_rng(1)
+    base = np.linspace(90, 200, w, dtype=np.float64)[np.newaxis, :, np.newaxis]
+    noise = rng.normal(0, 12, (h, w, 3))
+    return np.clip(base + noise, 0, 255).astype(np.uint8)
+
+
+def reference_region(image, points, color, intensity, makeup_type, kernel_size):
+    mask = np.zeros(image.shape[:2], dtype=np.uint8)
+    points = np.asarray(points, dtype=np.int32)
+    if makeup_type == "lips":
+        cv2.fillPoly(mask, [points], 255)
+    else:
+        cv2.fillPoly(mask, [cv2.convexHull(points)], 255)
+    mask = cv2.GaussianBlur(mask, (kernel_size, kernel_size), 0)
+
+    color_layer = np.full_like(image, color, dtype=np.uint8)
+    mask_3d = np.stack([mask / 255.0] * 3, axis=2)
+    intensity_factor = intensity / 100.0
+    if makeup_type == "lips":
+        alpha = intensity_factor * 0.7
+        image_float = image.astype(np.float64)
+        multiply_blend = (image_float * color_layer.astype(np.float64)) / 255.0
+        result = image_float * (1 - mask_3d * alpha) + multiply_blend * mask_3d * alpha
+        return np.clip(result, 0, 255).astype(np.uint8)
+    alpha = intensity_factor * 0.4
+    result = image * (1 - mask_3d * alpha) + color_layer * mask_3d * alpha
+    return result.astype(np.uint8)
+
+
+def reference_makeup(processor, image, landmarks):
+    colors = {"lips": LIPS, "cheeks": CHEEKS}
+    result = image.copy()
+    for makeup_type, areas in processor.MAKEUP_LAYERS:
+        color, intensity = colors[makeup_type]
+        kernel_size = processor.get_blur_kernel_size(image.shape, makeup_type)
+        for points in processor.get_face_polygons(landmarks, areas):
+            result = reference_region(result, points, color, intensity, makeup_type, kernel_size)
+    return result
+
+
+def max_difference(processor, image, landmarks):
+    expected = reference_makeup(processor, image, landmarks)
+    actual = processor.apply_makeup_to_landmarks(image.copy(), landmarks, *LIPS, *CHEEKS)
+    return int(np.abs(actual.astype(np.int16) - expected.astype(np.int16)).max())
+
+
+def test_single_face(processor):
+    image = make_image()
+    landmarks = make_face(320, 200)[np.newaxis]
+    assert max_difference(processor, image, landmarks) <= TOLERANCE
+
+
+def test_overlapping_cheeks(processor):
+    # Cheek ovals pulled towards the nose until they overlap
+    image = make_image()
+    landmarks = make_face(320, 200, cheek_spread=0.15)[np.newaxis]
+    assert max_difference(processor, image, landmarks) <= TOLERANCE
+
+
+def test_overlapping_faces(processor):
+    # Two faces close enough for a cheek of one to cover a cheek of the other
+    image = make_image()
+    landmarks = np.stack([make_face(250, 200), make_face(390, 200)])
+    assert max_difference(processor, image, landmarks) <= TOLERANCE
+
+
+def test_single_region(processor):
+    image = make_image()
+    landmarks = make_face(320, 200)[np.newaxis]
+    expected = image.copy()
+    kernel_size = processor.get_blur_kernel_size(image.shape, "lips")
+    for points in processor.get_face_polygons(landmarks, ["LIPS"]):
+        expected = reference_region(expected, points, *LIPS, "lips", kernel_size)
+    actual = processor.apply_makeup_with_gradient(image.copy(), landmarks, "LIPS", *LIPS, "lips")
+    assert int(np.abs(actual.astype(np.int16) - expected.astype(np.int16)).max()) <= TOLERANCE